@@ -1,6 +1,7 @@
 from django.contrib import admin
 
-from .models import Post, Group, Follow, Comment
+from . import search
+from .models import Post, Group, Follow, Comment, Job
 
 
 class PostAdmin(admin.ModelAdmin):
@@ -19,6 +20,11 @@ class PostAdmin(admin.ModelAdmin):
     )
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        if not search.is_available():
+            return super().get_search_results(request, queryset, search_term)
+        return search.filter_posts(queryset, search_term), False
+
 
 class GroupAdmin(admin.ModelAdmin):
     list_display = (
@@ -59,7 +65,26 @@ class CommentAdmin(admin.ModelAdmin):
     )
 
 
+class JobAdmin(admin.ModelAdmin):
+    list_display = (
+        'pk',
+        'task',
+        'state',
+        'attempts',
+        'run_at',
+        'last_error',
+    )
+    search_fields = (
+        'task',
+        'dedup_key',
+    )
+    list_filter = (
+        'state',
+    )
+
+
 admin.site.register(Post, PostAdmin)
 admin.site.register(Group, GroupAdmin)
 admin.site.register(Follow, FollowAdmin)
 admin.site.register(Comment, CommentAdmin)
+admin.site.register(Job, JobAdmin)
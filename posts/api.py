@@ -0,0 +1,192 @@
+import datetime
+from functools import wraps
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import require_GET
+
+from . import feed
+from .db import replica_reads
+from .models import Comment, Group, Post
+from .pagination import PER_PAGE, CursorPaginator, InvalidCursor
+
+User = get_user_model()
+
+# Больше записей за один запрос API не отдаёт
+MAX_LIMIT = 100
+
+# Поля записи в ответе API -> путь для `values()`
+POST_FIELDS = {
+    'id': 'pk',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+    'comments_count': 'comments_count',
+}
+COMMENT_FIELDS = {
+    'id': 'pk',
+    'text': 'text',
+    'created': 'created',
+    'author': 'author__username',
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def api_view(view):
+    """
+    Оборачивает вью API: только GET, чтение из реплики,
+    `BadRequest` превращается в 400.
+    """
+    @require_GET
+    @replica_reads
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        try:
+            return view(request, *args, **kwargs)
+        except BadRequest as e:
+            return error(str(e), 400)
+    return wrapper
+
+
+def requested_fields(request, fields):
+    """
+    Поля из `?fields=id,text`; без параметра — все.
+    """
+    names = request.GET.get('fields')
+    if not names:
+        return list(fields)
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = set(names) - set(fields)
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(sorted(unknown))}')
+    return names
+
+
+def requested_limit(request):
+    limit = request.GET.get('limit', PER_PAGE)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise BadRequest('limit должен быть числом')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def serialize(rows, names, fields):
+    """
+    Строки `values()` в словари с публичными именами полей.
+    Даты отдаются с микросекундами, чтобы их можно было
+    вернуть в `?since=` без потери точности.
+    """
+    result = []
+    for row in rows:
+        item = {}
+        for name in names:
+            value = row[fields[name]]
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            elif name == 'image':
+                value = default_storage.url(value) if value else None
+            item[name] = value
+        result.append(item)
+    return result
+
+
+def cursor_list(request, queryset, fields, field, key='pk'):
+    """
+    Страница списка по курсору `?after=` с записями новее `?since=`.
+    В `values()` попадают только запрошенные поля и поля курсора.
+    """
+    names = requested_fields(request, fields)
+    since = request.GET.get('since')
+    if since:
+        try:
+            since_date = parse_datetime(since)
+        except ValueError:
+            # Формат верный, но такой даты нет, например 13-й месяц
+            since_date = None
+        if since_date is None:
+            raise BadRequest('since должен быть датой в формате ISO 8601')
+        if timezone.is_naive(since_date):
+            # Дата без смещения — в часовом поясе сайта, как в формах
+            since_date = timezone.make_aware(since_date)
+        queryset = queryset.filter(**{f'{field}__gt': since_date})
+    paths = {fields[name] for name in names} | {field, key}
+    paginator = CursorPaginator(queryset.values(*paths),
+                                requested_limit(request), field, key)
+    after = request.GET.get('after')
+    try:
+        page = paginator.page_after(after) if after else paginator.first_page()
+    except InvalidCursor:
+        raise BadRequest('Неверный курсор')
+    return {
+        'results': serialize(page, names, fields),
+        'next': page.next_cursor,
+    }
+
+
+@api_view
+def index(request):
+    return JsonResponse(cursor_list(request, Post.objects.all(),
+                                    POST_FIELDS, 'pub_date'))
+
+
+@api_view
+def group_posts(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True).first()
+    if group_id is None:
+        return error('Сообщество не найдено', 404)
+    return JsonResponse(cursor_list(
+        request, Post.objects.filter(group_id=group_id),
+        POST_FIELDS, 'pub_date'))
+
+
+@api_view
+def profile(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True).first()
+    if author_id is None:
+        return error('Пользователь не найден', 404)
+    return JsonResponse(cursor_list(
+        request, Post.objects.filter(author_id=author_id),
+        POST_FIELDS, 'pub_date'))
+
+
+@api_view
+def follow_index(request):
+    if not request.user.is_authenticated:
+        return error('Нужна авторизация', 401)
+    return JsonResponse(cursor_list(
+        request, feed.follow_feed(request.user),
+        POST_FIELDS, 'feed_pub_date', 'feed_post'))
+
+
+@api_view
+def post_detail(request, post_id):
+    """
+    Запись с первой страницей комментариев; следующие страницы
+    комментариев — по `?after=`, поля комментариев — `?fields=`.
+    """
+    post = Post.objects.filter(pk=post_id).values(*POST_FIELDS.values())
+    post = serialize(post, POST_FIELDS, POST_FIELDS)
+    if not post:
+        return error('Запись не найдена', 404)
+    comments = cursor_list(request, Comment.objects.filter(post_id=post_id),
+                           COMMENT_FIELDS, 'created')
+    return JsonResponse({
+        'post': post[0],
+        'comments': comments['results'],
+        'next': comments['next'],
+    })
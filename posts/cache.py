@@ -0,0 +1,280 @@
+import datetime
+import hashlib
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_vary_headers
+from django.views.decorators.http import condition
+
+from . import db
+
+VERSION_KEY = 'version:{}'
+# Время последнего сдвига версии области, для Last-Modified
+MODIFIED_KEY = 'modified:{}'
+LOCK_KEY = '{}:lock'
+# Сколько секунд держится блокировка пересчёта и сколько её ждут
+LOCK_TIMEOUT = 10
+LOCK_WAIT_STEP = 0.05
+# Сколько секунд после истечения запись ещё можно отдать устаревшей
+STALE_TIMEOUT = 60
+# Чем больше, тем раньше запись пересчитывается до истечения
+EARLY_RECOMPUTE_BETA = 1.0
+
+# Потоки синхронных обёрток асинхронных страниц. Такой поток ждёт вью
+# целиком, поэтому у них свой пул: в общем они заняли бы места
+# запросов к базе из `db.run_query`.
+_page_executor = ThreadPoolExecutor(thread_name_prefix='page')
+
+
+def initial_version():
+    # Версия, выросшая из времени, не совпадёт с прежними,
+    # даже если счётчик был вытеснен из кэша.
+    return time.time_ns() // 1000
+
+
+def get_versions(*scopes):
+    """
+    Текущие версии для списка областей, например `post:1`, `group:2`.
+    """
+    keys = [VERSION_KEY.format(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for scope, key in zip(scopes, keys):
+        if key not in versions:
+            if cache.add(key, initial_version(), None):
+                # Когда область менялась раньше, неизвестно,
+                # поэтому считаем, что только что.
+                cache.set(MODIFIED_KEY.format(scope), time.time(), None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def read_scopes(*scopes):
+    """
+    Области, от которых зависит прочитанное в этом запросе. Данные
+    из реплики ещё зависят от её копии: закэшированное по ним живёт
+    только до следующего `replicate_db`.
+    """
+    if db.using_replica():
+        return (*scopes, db.REPLICA)
+    return scopes
+
+
+def modified_at(*scopes):
+    """
+    Когда последний раз сдвигалась версия одной из областей,
+    или None, если это неизвестно.
+    """
+    keys = [MODIFIED_KEY.format(scope) for scope in scopes]
+    times = cache.get_many(keys)
+    if len(times) < len(keys):
+        return None
+    return datetime.datetime.fromtimestamp(max(times.values()),
+                                           datetime.timezone.utc)
+
+
+def bump(*scopes):
+    """
+    Сдвигает версии областей: всё, что было закэшировано
+    под старыми версиями, больше не используется.
+
+    Версии сдвигаются сразу и ещё раз после коммита транзакции,
+    чтобы страница, собранная до коммита по старым данным,
+    не осталась в кэше под новой версией.
+    """
+    incr_versions(scopes)
+    transaction.on_commit(lambda: incr_versions(scopes))
+
+
+def incr_versions(scopes):
+    now = time.time()
+    for scope in scopes:
+        key = VERSION_KEY.format(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, initial_version(), None)
+    cache.set_many({MODIFIED_KEY.format(scope): now for scope in scopes},
+                   None)
+
+
+def page_scopes(post):
+    """
+    Области кэша страниц, на которых выводится карточка записи.
+    """
+    scopes = ['index', f'profile:{post.author.username}']
+    if post.group_id is not None:
+        scopes.append(f'group_page:{post.group.slug}')
+    return scopes
+
+
+def card_version(post):
+    """
+    Версия карточки записи: меняется при правке записи,
+    её комментариев и сообщества.
+    """
+    return '.'.join(map(str, get_versions(*read_scopes(
+        f'post:{post.pk}', f'group:{post.group_id}'
+    ))))
+
+
+def get_or_compute(key, compute, timeout, version=None, should_cache=None):
+    """
+    Достаёт значение из кэша или считает его через `compute()`.
+
+    Пересчитывает ключ только один запрос: остальные в это время получают
+    устаревшее значение, а если его нет — ждут результата. Незадолго
+    до истечения запись с некоторой вероятностью пересчитывается заранее
+    (тем раньше, чем дольше она считалась), чтобы не истекать под
+    нагрузкой. Запись с другой `version` считается устаревшей.
+    """
+    entry = cache.get(key)
+    if entry is not None and is_fresh(entry, version):
+        return entry[0]
+    lock_key = LOCK_KEY.format(key)
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    if not locked:
+        if entry is not None:
+            return entry[0]
+        entry = wait_for(key, version)
+        if entry is not None:
+            return entry[0]
+    try:
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        if should_cache is None or should_cache(value):
+            expires = None if timeout is None else time.time() + timeout
+            cache.set(key, (value, version, expires, delta),
+                      None if timeout is None else timeout + STALE_TIMEOUT)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return value
+
+
+def is_fresh(entry, version):
+    value, entry_version, expires, delta = entry
+    if entry_version != version:
+        return False
+    if expires is None:
+        return True
+    early = -delta * EARLY_RECOMPUTE_BETA * math.log(1 - random.random())
+    return time.time() + early < expires
+
+
+def wait_for(key, version):
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(LOCK_WAIT_STEP)
+        entry = cache.get(key)
+        if entry is not None and entry[1] == version:
+            return entry
+        if cache.get(LOCK_KEY.format(key)) is None:
+            return entry
+    return None
+
+
+def cache_page_versioned(scopes):
+    """
+    Аналог `cache_page`, у которого вместо короткого TTL к записи
+    привязаны версии областей. `scopes(**kwargs)` получает аргументы вью
+    и возвращает области страницы; кроме них страница всегда зависит
+    от области `groups`. Страница живёт в кэше, пока одна из этих
+    версий не сдвинется, и пересчитывается через `get_or_compute`.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+            version = '.'.join(map(str, get_versions(*read_scopes(
+                'groups', *scopes(**kwargs)))))
+            return get_or_compute(
+                page_cache_key(request, view.__name__),
+                lambda: render_page(view, request, *args, **kwargs),
+                settings.POSTS_PAGE_CACHE_TIMEOUT,
+                version=version,
+                should_cache=is_cacheable,
+            )
+        return wrapper
+    return decorator
+
+
+def conditional_page(scopes):
+    """
+    Условный GET по версиям областей: ETag — хэш версий `groups`
+    и `scopes(**kwargs)` вместе с пользователем, Last-Modified — время
+    последнего сдвига этих версий. Совпавший запрос получает 304
+    ещё до обращения к базе и шаблонам.
+
+    Last-Modified отдаётся только анонимам: страница зависит
+    от пользователя, а If-Modified-Since этого не различает.
+    """
+    def etag(request, **kwargs):
+        versions = get_versions(*read_scopes('groups', *scopes(**kwargs)))
+        user = request.user.pk if request.user.is_authenticated else ''
+        return hashlib.md5(
+            f'{user}|{".".join(map(str, versions))}'.encode()
+        ).hexdigest()
+
+    def last_modified(request, **kwargs):
+        if request.user.is_authenticated:
+            return None
+        return modified_at(*read_scopes('groups', *scopes(**kwargs)))
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+def sync_page(*decorators):
+    """
+    Навешивает синхронные декораторы страниц (`conditional_page`,
+    `cache_page_versioned`) на асинхронную вью. Все они работают
+    за один переход в поток, а сама вью — в цикле событий.
+    """
+    def decorator(view):
+        @wraps(view)
+        def sync_view(request, *args, **kwargs):
+            return async_to_sync(view)(request, *args, **kwargs)
+
+        for page_decorator in reversed(decorators):
+            sync_view = page_decorator(sync_view)
+
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            return await sync_to_async(
+                sync_view, thread_sensitive=False, executor=_page_executor,
+            )(request, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def page_cache_key(request, name):
+    # Страницы зависят от пользователя, поэтому ключ включает сессию.
+    session = request.COOKIES.get(settings.SESSION_COOKIE_NAME, '')
+    url = hashlib.md5(
+        f'{request.build_absolute_uri()}|{session}'.encode()
+    ).hexdigest()
+    return f'page:{name}:{url}'
+
+
+def render_page(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    session = getattr(request, 'session', None)
+    if session is not None and session.accessed:
+        patch_vary_headers(response, ('Cookie',))
+    return response
+
+
+def is_cacheable(response):
+    if response.streaming or response.status_code != 200:
+        return False
+    if response.cookies:
+        return False
+    return 'private' not in response.get('Cache-Control', ())
@@ -0,0 +1,66 @@
+import os
+import pickle
+import tempfile
+import zlib
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.files import locks
+
+
+class SharedFileCache(FileBasedCache):
+    """
+    Файловый кэш, общий для процессов сайта и фоновых команд.
+
+    В отличие от `FileBasedCache`, `add` и `incr` атомарны и между
+    процессами: на `add` держатся блокировки `get_or_compute`,
+    на `incr` — версии областей и числа записей лент.
+    """
+    lock_name = 'incr.lock'
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        # has_key заодно удаляет истёкшую запись
+        if self.has_key(key, version):
+            return False
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        self._cull()
+        fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+        try:
+            with open(fd, 'wb') as f:
+                self._write_content(f, timeout, value)
+            # Ссылка не создаётся поверх существующего файла: из двух
+            # процессов запись добавит только один.
+            os.link(tmp_path, fname)
+        except FileExistsError:
+            return False
+        finally:
+            os.remove(tmp_path)
+        return True
+
+    def incr(self, key, delta=1, version=None):
+        self._createdir()
+        fname = self._key_to_file(key, version)
+        with open(os.path.join(self._dir, self.lock_name), 'ab') as lock:
+            locks.lock(lock, locks.LOCK_EX)
+            try:
+                try:
+                    with open(fname, 'rb') as f:
+                        if self._is_expired(f):
+                            raise ValueError(f"Key '{key}' not found")
+                        f.seek(0)
+                        expiry = pickle.load(f)
+                        value = pickle.loads(zlib.decompress(f.read()))
+                except FileNotFoundError:
+                    raise ValueError(f"Key '{key}' not found")
+                value += delta
+                # Срок записи не продлевается, как у LocMemCache.
+                fd, tmp_path = tempfile.mkstemp(dir=self._dir)
+                with open(fd, 'wb') as f:
+                    f.write(pickle.dumps(expiry, self.pickle_protocol))
+                    f.write(zlib.compress(
+                        pickle.dumps(value, self.pickle_protocol)))
+                os.replace(tmp_path, fname)
+                return value
+            finally:
+                locks.unlock(lock)
@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core import checks
+
+# Кэши, которые каждый процесс держит у себя
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+@checks.register(checks.Tags.caches)
+def replica_cache_check(app_configs, **kwargs):
+    """
+    Версию реплики сдвигает отдельный процесс `replicate_db`. Если кэш
+    у каждого процесса свой, сайт этого сдвига не увидит и будет
+    отдавать страницы, собранные по устаревшей реплике, как свежие.
+    """
+    if not settings.POSTS_REPLICA_READS:
+        return []
+    if settings.CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHES:
+        return []
+    return [checks.Error(
+        'Чтение из реплики требует общего для процессов кэша.',
+        hint='Укажите в CACHES файловый, базовый или внешний кэш, '
+             'например posts.cache_backends.SharedFileCache.',
+        id='posts.E001',
+    )]
@@ -0,0 +1,166 @@
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from . import jobs
+from .models import Comment, Follow, Post, UserStats
+
+User = get_user_model()
+
+FEED_COUNT_KEY = 'feed_count:{}'
+
+
+def count_of(model, field, outer='pk'):
+    """
+    Подзапрос с количеством строк `model`, ссылающихся на внешнюю запись.
+    """
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef(outer)}
+        ).order_by().values(field).annotate(n=Count('pk')).values('n')
+    ), 0)
+
+
+def shifted(field, delta):
+    """
+    `field + delta`, но не ниже нуля: если счётчик разошёлся с данными,
+    например после `bulk_create` мимо сигналов, вычитание не должно
+    нарушать ограничение положительного поля и ронять удаление.
+    """
+    if delta >= 0:
+        return F(field) + delta
+    return Greatest(F(field) + delta, 0)
+
+
+def change_comments_count(post_id, delta):
+    Post.objects.filter(pk=post_id).update(
+        comments_count=shifted('comments_count', delta)
+    )
+
+
+def change_user_stats(user_id, **deltas):
+    """
+    Сдвигает счётчики пользователя, например `posts_count=1`.
+    Если строки со статистикой ещё нет, она пересчитывается с нуля.
+    """
+    updated = UserStats.objects.filter(user_id=user_id).update(
+        **{field: shifted(field, delta) for field, delta in deltas.items()}
+    )
+    if not updated and all(delta > 0 for delta in deltas.values()):
+        rebuild_user_stats(User.objects.filter(pk=user_id))
+
+
+def feed_count(scope, count):
+    """
+    Число записей ленты `scope` (`index`, `group:1`) для пагинации.
+    Считается вызовом `count` только при промахе кэша, дальше сдвигается
+    сигналами записей; POSTS_FEED_COUNT_TIMEOUT ограничивает, как долго
+    накапливается расхождение, например от `update()` мимо сигналов.
+    """
+    key = FEED_COUNT_KEY.format(scope)
+    value = cache.get(key)
+    if value is None:
+        value = count()
+        cache.add(key, value, settings.POSTS_FEED_COUNT_TIMEOUT)
+    return value
+
+
+def change_feed_counts(delta, *scopes):
+    """
+    Сдвигает закэшированные числа записей лент после коммита
+    транзакции: откаченная запись их не меняет. Ещё не посчитанные
+    не трогаются: их посчитает первое чтение.
+    """
+    def shift():
+        for scope in scopes:
+            try:
+                cache.incr(FEED_COUNT_KEY.format(scope), delta)
+            except ValueError:
+                pass
+
+    transaction.on_commit(shift)
+
+
+def feed_scopes(group_id):
+    if group_id is None:
+        return ['index']
+    return ['index', f'group:{group_id}']
+
+
+def rebuild_comments_counts(posts):
+    posts.update(comments_count=count_of(Comment, 'post'))
+
+
+def rebuild_user_stats(users):
+    UserStats.objects.bulk_create(
+        (UserStats(user_id=pk) for pk in users.values_list('pk', flat=True)),
+        ignore_conflicts=True,
+    )
+    UserStats.objects.filter(user__in=users).update(
+        posts_count=count_of(Post, 'author', 'user'),
+        followers_count=count_of(Follow, 'author', 'user'),
+        following_count=count_of(Follow, 'user', 'user'),
+    )
+
+
+def batches(model, batch_size):
+    """
+    Границы (первый id, последний id, размер) пачек по `batch_size` строк.
+    """
+    last_pk = 0
+    while True:
+        pks = list(model.objects.filter(
+            pk__gt=last_pk
+        ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return
+        yield pks[0], pks[-1], len(pks)
+        last_pk = pks[-1]
+
+
+# Что пересчитывается для строк каждой модели
+REBUILDS = {
+    'posts.Post': rebuild_comments_counts,
+    settings.AUTH_USER_MODEL: rebuild_user_stats,
+}
+
+
+def rebuild_range(label, first_pk, last_pk):
+    """
+    Пересчитывает счётчики строк модели `label` с id от `first_pk`
+    до `last_pk` в одной транзакции.
+    """
+    model = apps.get_model(label)
+    with transaction.atomic():
+        REBUILDS[label](model.objects.filter(pk__gte=first_pk,
+                                             pk__lte=last_pk))
+
+
+def rebuild_all(batch_size=1000):
+    """
+    Пересчитывает все счётчики пачками по `batch_size` строк,
+    каждая пачка — в своей транзакции.
+    """
+    for label in REBUILDS:
+        model = apps.get_model(label)
+        for first_pk, last_pk, size in batches(model, batch_size):
+            rebuild_range(label, first_pk, last_pk)
+            yield model, size
+
+
+def queue_rebuild(batch_size=1000):
+    """
+    То же, что `rebuild_all`, но каждая пачка — фоновая задача.
+    """
+    for label in REBUILDS:
+        model = apps.get_model(label)
+        for first_pk, last_pk, size in batches(model, batch_size):
+            jobs.enqueue(
+                rebuild_range, label, first_pk, last_pk,
+                dedup_key=f'counters:{label}:{first_pk}:{last_pk}',
+            )
+            yield model, size
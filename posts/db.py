@@ -0,0 +1,159 @@
+import asyncio
+import contextvars
+import sqlite3
+import time
+from contextlib import closing, contextmanager
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+
+REPLICA = 'replica'
+# Кука со временем, до которого пользователь читает из основной базы
+STICKY_COOKIE = 'primary_until'
+
+_reading_replica = contextvars.ContextVar('reading_replica', default=False)
+
+
+def apply_pragmas(cursor, pragmas):
+    """
+    Выполняет `PRAGMA имя = значение` для каждой пары из `pragmas`.
+    """
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def using_replica():
+    return _reading_replica.get()
+
+
+@contextmanager
+def reading_replica():
+    token = _reading_replica.set(True)
+    try:
+        yield
+    finally:
+        _reading_replica.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтения моделей `posts` внутри `reading_replica()` идут в реплику,
+    остальное — в основную базу. Сессии и пользователи всегда читаются
+    из основной: свежий вход не должен зависеть от копии. Реплика —
+    копия основной базы, поэтому миграции на ней не выполняются.
+    """
+
+    def db_for_read(self, model, **hints):
+        if using_replica() and model._meta.app_label == 'posts':
+            return REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db != REPLICA
+
+
+def is_sticky(request):
+    """
+    Писал ли пользователь так недавно, что реплика могла
+    ещё не получить его изменения.
+    """
+    try:
+        return float(request.COOKIES.get(STICKY_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+def wants_replica(request):
+    return (settings.POSTS_REPLICA_READS
+            and request.method in ('GET', 'HEAD')
+            and not is_sticky(request))
+
+
+def replica_reads(view):
+    """
+    GET-запросы к вью читают из реплики, если она включена
+    (POSTS_REPLICA_READS) и пользователь недавно ничего не менял.
+    Подходит и для асинхронных вью.
+    """
+    if asyncio.iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if not wants_replica(request):
+                return await view(request, *args, **kwargs)
+            with reading_replica():
+                return await view(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not wants_replica(request):
+            return view(request, *args, **kwargs)
+        with reading_replica():
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+def run_query(func, *args, **kwargs):
+    """
+    Выполняет синхронный код ORM из асинхронной вью. Каждый вызов идёт
+    в потоке из пула со своим соединением, поэтому несколько запросов,
+    собранных в `asyncio.gather`, выполняются параллельно. Соединение
+    потока переиспользуется следующими вызовами.
+    """
+    return sync_to_async(func, thread_sensitive=False)(*args, **kwargs)
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Если запрос что-то записал в основную базу, следующие
+    POSTS_REPLICA_STICKY_SECONDS секунд пользователь читает только
+    из неё и видит свои изменения.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.POSTS_REPLICA_READS:
+            return self.get_response(request)
+        writes = []
+
+        def watch(execute, sql, params, many, context):
+            if not sql.lstrip().upper().startswith(
+                    ('SELECT', 'SAVEPOINT', 'RELEASE', 'PRAGMA')):
+                writes.append(sql)
+            return execute(sql, params, many, context)
+
+        with connections['default'].execute_wrapper(watch):
+            response = self.get_response(request)
+        if writes:
+            seconds = settings.POSTS_REPLICA_STICKY_SECONDS
+            response.set_cookie(STICKY_COOKIE, str(time.time() + seconds),
+                                max_age=seconds, httponly=True,
+                                samesite='Lax')
+        return response
+
+
+def replicate(source=None, target=None):
+    """
+    Копирует основную базу SQLite в реплику через backup API
+    и сбрасывает всё, что закэшировано по данным реплики. Сброс доходит
+    до процессов сайта только через общий кэш (проверка posts.E001).
+    По умолчанию пути берутся из настроек соединений.
+    """
+    from . import cache
+
+    source = source or connections['default'].settings_dict['NAME']
+    target = target or connections[REPLICA].settings_dict['NAME']
+    with closing(sqlite3.connect(source)) as primary, \
+            closing(sqlite3.connect(target)) as replica:
+        primary.backup(replica)
+    cache.incr_versions([REPLICA])
@@ -0,0 +1,200 @@
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from . import jobs
+from .cache import get_or_compute
+from .models import FeedItem, Follow, Post, UserStats
+
+POPULAR_AUTHORS_KEY = 'feed:popular_authors'
+POPULAR_AUTHORS_TIMEOUT = 60 * 10
+
+
+def popular_author_ids():
+    """
+    Авторы, чьи записи не раскладываются по лентам подписчиков.
+    Число подписчиков берётся из `UserStats` по индексу, а не
+    группировкой всей таблицы подписок.
+    """
+    return get_or_compute(
+        POPULAR_AUTHORS_KEY,
+        lambda: set(
+            UserStats.objects.filter(
+                followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+            ).values_list('user', flat=True)
+        ),
+        POPULAR_AUTHORS_TIMEOUT,
+    )
+
+
+def followers_of(author_id):
+    return Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True)
+
+
+def fan_out(post):
+    """
+    Раскладывает новую запись по лентам подписчиков автора. Если их больше
+    FEED_FANOUT_INLINE_MAX, раскладка уходит в фоновую задачу `deliver`,
+    чтобы не задерживать публикацию.
+    """
+    if post.author_id in popular_author_ids():
+        return
+    limit = settings.FEED_FANOUT_INLINE_MAX
+    followers = list(followers_of(post.author_id)[:limit + 1])
+    if len(followers) > limit:
+        jobs.enqueue(deliver, post.pk, dedup_key=f'fan_out:{post.pk}')
+        return
+    add(post, followers)
+
+
+def deliver(post_id):
+    """
+    Раскладывает запись по лентам всех подписчиков автора.
+    """
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return
+    add(post, followers_of(post.author_id))
+
+
+def add(post, followers):
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user_id, post=post, pub_date=post.pub_date)
+         for user_id in followers),
+        batch_size=settings.FEED_FANOUT_BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    if post.pk % settings.FEED_TRIM_EVERY == 0:
+        trim(followers)
+
+
+def backfill(user_id, author_id):
+    """
+    Добавляет в ленту пользователя последние записи нового автора.
+    """
+    if author_id in popular_author_ids():
+        return
+    posts = Post.objects.filter(
+        author_id=author_id
+    ).order_by('-pub_date').values_list('pk', 'pub_date')
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=user_id, post_id=post_id, pub_date=pub_date)
+         for post_id, pub_date in posts[:settings.FEED_MAX_SIZE]),
+        ignore_conflicts=True,
+    )
+    trim([user_id])
+
+
+def remove(user_id, author_id):
+    FeedItem.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def trim(user_ids):
+    """
+    Оставляет в лентах пользователей не больше FEED_MAX_SIZE записей.
+    """
+    size = settings.FEED_MAX_SIZE
+    oldest_kept = FeedItem.objects.filter(
+        user=OuterRef('user')
+    ).order_by('-pub_date').values('pub_date')[size - 1:size]
+    FeedItem.objects.filter(
+        user__in=user_ids,
+        pub_date__lt=Subquery(oldest_kept),
+    ).delete()
+
+
+REBUILD_SQL = '''
+    INSERT INTO {feed} (user_id, post_id, pub_date)
+    SELECT user_id, post_id, pub_date FROM (
+        SELECT follow.user_id, post.id AS post_id, post.pub_date,
+               ROW_NUMBER() OVER (
+                   PARTITION BY follow.user_id ORDER BY post.pub_date DESC
+               ) AS position
+        FROM {follow} follow
+        JOIN {post} post ON post.author_id = follow.author_id
+        WHERE follow.user_id IN ({users}) AND follow.author_id NOT IN ({popular})
+    ) feed
+    WHERE position <= %s
+'''
+
+
+def rebuild(user_ids):
+    """
+    Собирает ленты пользователей заново одним INSERT ... SELECT,
+    например после загрузки подписок и записей через `bulk_create`,
+    минуя сигналы.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    popular = list(popular_author_ids()) or [0]
+    FeedItem.objects.filter(user__in=user_ids).delete()
+    sql = REBUILD_SQL.format(
+        feed=FeedItem._meta.db_table,
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+        users=', '.join(['%s'] * len(user_ids)),
+        popular=', '.join(['%s'] * len(popular)),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*user_ids, *popular, settings.FEED_MAX_SIZE])
+
+
+def followed_popular(user):
+    """
+    Популярные авторы, на которых подписан пользователь.
+    """
+    popular = popular_author_ids()
+    if not popular:
+        return []
+    return list(Follow.objects.filter(
+        user=user, author__in=popular
+    ).values_list('author', flat=True))
+
+
+def follow_feed(user, popular=None):
+    """
+    Записи ленты подписок пользователя.
+
+    Обычно это чтение готовой ленты по индексу. Записи популярных авторов
+    в ленту не попадают, поэтому если пользователь подписан на таких,
+    они добавляются живым запросом. `popular` — результат
+    `followed_popular`, если он уже получен.
+
+    Лента сортируется по `feed_pub_date`, `feed_post`: для готовой ленты
+    это поля `FeedItem`, и сортировка идёт прямо по его индексу.
+    """
+    if popular is None:
+        popular = followed_popular(user)
+    if popular:
+        return Post.objects.filter(
+            Q(pk__in=FeedItem.objects.filter(
+                user=user).values('post'))
+            | Q(author__in=popular)
+        ).annotate(feed_pub_date=F('pub_date'), feed_post=F('pk'))
+    return Post.objects.filter(feed_items__user=user).annotate(
+        feed_pub_date=F('feed_items__pub_date'),
+        feed_post=F('feed_items__post'),
+    )
+
+
+def follow_count(user, popular):
+    """
+    Число записей ленты подписок для пагинации: строки готовой ленты
+    пользователя (не больше FEED_MAX_SIZE, по индексу) плюс счётчики
+    записей популярных авторов из `popular`.
+    """
+    items = FeedItem.objects.filter(user=user)
+    if not popular:
+        return items.count()
+    # Строки, разложенные до того, как автор стал популярным,
+    # уже посчитаны в его счётчике.
+    count = items.exclude(post__author__in=popular).count()
+    count += UserStats.objects.filter(user__in=popular).aggregate(
+        posts=Coalesce(Sum('posts_count'), 0))['posts']
+    return count
@@ -0,0 +1,73 @@
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from .models import Follow
+
+User = get_user_model()
+
+
+def follow(user, author):
+    """
+    Подписывает `user` на `author` одним INSERT, который пропускает
+    уже существующую подписку. Возвращает True, если подписка появилась.
+    """
+    if user.pk == author.pk:
+        return False
+    table = Follow._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{connection.ops.insert_statement(ignore_conflicts=True)} '
+            f'{table} (user_id, author_id) VALUES (%s, %s)'
+            f'{connection.ops.ignore_conflicts_suffix_sql(True)}',
+            [user.pk, author.pk]
+        )
+        created = cursor.rowcount == 1
+    if created:
+        # Строка вставлена мимо ORM, поэтому счётчики, лента
+        # и кэш узнают о ней из сигнала, отправленного вручную.
+        post_save.send(Follow, instance=Follow(user=user, author=author),
+                       created=True, raw=False, using=connection.alias,
+                       update_fields=None)
+    return created
+
+
+def unfollow(user, author):
+    """
+    Отписывает `user` от `author` одним DELETE.
+    Возвращает True, если подписка была.
+    """
+    table = Follow._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {table} WHERE user_id = %s AND author_id = %s',
+            [user.pk, author.pk]
+        )
+        deleted = cursor.rowcount == 1
+    if deleted:
+        post_delete.send(Follow, instance=Follow(user=user, author=author),
+                         using=connection.alias)
+    return deleted
+
+
+def change_many(user, usernames, subscribe=True):
+    """
+    Подписывает (или отписывает) `user` на всех авторов из `usernames`
+    в одной транзакции. Возвращает пару: имена авторов, у которых
+    подписка изменилась, и имена, которых нет среди пользователей.
+
+    Каждый автор — отдельный INSERT или DELETE со своими сигналами
+    (счётчики, лента до FEED_MAX_SIZE записей, кэш): так изменённые
+    подписки точно известны и при одновременных запросах. Стоимость
+    растёт с длиной списка, поэтому вью ограничивает её
+    POSTS_FOLLOW_BULK_MAX.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    authors = User.objects.filter(username__in=usernames).in_bulk(
+        field_name='username')
+    action = follow if subscribe else unfollow
+    with transaction.atomic():
+        changed = [username for username, author in authors.items()
+                   if action(user, author)]
+    missing = [username for username in usernames if username not in authors]
+    return changed, missing
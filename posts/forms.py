@@ -1,6 +1,9 @@
 from django import forms
+from django.conf import settings
+from django.template.defaultfilters import filesizeformat
 
 from .models import Post, Comment
+from .uploadhandlers import RejectedUpload
 
 
 class PostForm(forms.ModelForm):
@@ -11,6 +14,34 @@ class PostForm(forms.ModelForm):
         )
         fields = '__all__'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.image_rejected = isinstance(self.files.get('image'),
+                                         RejectedUpload)
+        if self.image_rejected:
+            self.files = self.files.copy()
+            del self.files['image']
+
+    def clean_image(self):
+        if self.image_rejected:
+            raise forms.ValidationError(
+                'Файл слишком большой, максимальный размер — %s.'
+                % filesizeformat(settings.POSTS_UPLOAD_MAX_SIZE)
+            )
+        image = self.cleaned_data['image']
+        # У нового файла ImageField уже прочитал заголовок картинки,
+        # размеры известны без декодирования пикселей.
+        header = getattr(image, 'image', None)
+        if header is not None:
+            width, height = header.size
+            if width * height > settings.POSTS_IMAGE_MAX_PIXELS:
+                raise forms.ValidationError(
+                    f'Картинка {width}×{height} слишком большая, '
+                    f'допустимо не больше '
+                    f'{settings.POSTS_IMAGE_MAX_PIXELS} пикселей.'
+                )
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
@@ -0,0 +1,150 @@
+import logging
+import random
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import (DatabaseError, IntegrityError, close_old_connections,
+                       transaction)
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def task_name(func):
+    return f'{func.__module__}.{func.__qualname__}'
+
+
+def enqueue(func, *args, dedup_key=None, delay=0, max_attempts=None):
+    """
+    Ставит вызов `func(*args)` в очередь. Задача пишется в ту же
+    транзакцию, что и данные, которые её породили: откат отменяет
+    и её. Аргументы должны сериализоваться в JSON, а `func` —
+    импортироваться по пути. Пока в очереди ждёт задача с тем же
+    `dedup_key`, новая не добавляется.
+    """
+    Job.objects.bulk_create([Job(
+        task=task_name(func),
+        args=list(args),
+        dedup_key=dedup_key,
+        max_attempts=max_attempts or settings.POSTS_JOBS_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )], ignore_conflicts=True)
+
+
+def backoff(attempts):
+    """
+    Пауза перед следующей попыткой: удваивается с каждой неудачей,
+    случайная доля разводит повторы задач, упавших вместе.
+    """
+    delay = min(settings.POSTS_JOBS_BACKOFF * 2 ** (attempts - 1),
+                settings.POSTS_JOBS_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+def claim(limit):
+    """
+    Забирает до `limit` готовых задач одним UPDATE и возвращает их.
+    Взятая задача скрыта от других исполнителей на
+    POSTS_JOBS_VISIBILITY_TIMEOUT секунд; если исполнитель за это время
+    не отчитался, задача снова считается готовой. Задача, исчерпавшая
+    попытки так, например уронив исполнителя, больше не берётся,
+    а помечается упавшей.
+    """
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    Job.objects.filter(
+        state=Job.RUNNING, run_at__lte=now,
+        attempts__gte=F('max_attempts'),
+    ).update(state=Job.FAILED, claim=None, dedup_key=None,
+             last_error='Исполнитель не отчитался о задаче')
+    ready = Job.objects.filter(
+        state__in=(Job.QUEUED, Job.RUNNING), run_at__lte=now,
+        attempts__lt=F('max_attempts'),
+    ).order_by('run_at').values('pk')[:limit]
+    Job.objects.filter(pk__in=ready).update(
+        state=Job.RUNNING,
+        claim=token,
+        attempts=F('attempts') + 1,
+        run_at=now + timedelta(
+            seconds=settings.POSTS_JOBS_VISIBILITY_TIMEOUT),
+    )
+    return list(Job.objects.filter(claim=token))
+
+
+def execute(job_id, token):
+    """
+    Выполняет взятую задачу вне транзакции: иначе SQLite держал бы
+    блокировку записи всё время задачи, пока та, например, режет
+    картинки. Записи в базу задача делает короткими транзакциями
+    сама и должна переносить повтор: удачная задача удаляется
+    отдельным запросом, упавшая откладывается до следующей попытки
+    или, если попытки кончились, остаётся в базе с ошибкой. Задачу,
+    которую уже забрал другой исполнитель, пропускает.
+    """
+    job = Job.objects.filter(pk=job_id, claim=token).first()
+    if job is None:
+        return
+    try:
+        import_string(job.task)(*job.args)
+    except Exception as error:
+        logger.exception('Задача %s не выполнена', job)
+        fail(job, token, repr(error))
+        return
+    Job.objects.filter(pk=job_id, claim=token).delete()
+
+
+def execute_in_worker(job_id, token):
+    """
+    `execute` в потоке или процессе `run_worker`: как и запрос к сайту,
+    задача начинается и заканчивается закрытием устаревших соединений.
+    Ошибка базы при чтении задачи или записи её результата, например
+    блокировка, не останавливает исполнителя: задача вернётся в очередь
+    по истечении POSTS_JOBS_VISIBILITY_TIMEOUT.
+    """
+    close_old_connections()
+    try:
+        execute(job_id, token)
+    except DatabaseError:
+        logger.exception('Задача %s отложена: ошибка базы', job_id)
+    finally:
+        close_old_connections()
+
+
+def fail(job, token, error):
+    mine = Job.objects.filter(pk=job.pk, claim=token)
+    if job.attempts >= job.max_attempts:
+        mine.update(state=Job.FAILED, claim=None, dedup_key=None,
+                    last_error=error)
+        return
+    try:
+        with transaction.atomic():
+            mine.update(
+                state=Job.QUEUED,
+                claim=None,
+                last_error=error,
+                run_at=timezone.now() + timedelta(
+                    seconds=backoff(job.attempts)),
+            )
+    except IntegrityError:
+        # В очереди уже ждёт такая же задача, она и выполнит работу.
+        mine.delete()
+
+
+def run_pending(limit=None):
+    """
+    Выполняет готовые задачи в текущем потоке, пока они не кончатся
+    или не наберётся `limit`. Возвращает число выполненных попыток.
+    """
+    done = 0
+    while limit is None or done < limit:
+        jobs = claim(1)
+        if not jobs:
+            break
+        execute(jobs[0].pk, jobs[0].claim)
+        done += 1
+    return done
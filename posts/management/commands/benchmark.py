@@ -0,0 +1,139 @@
+import json
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from posts.models import Comment, Group, Post
+from posts.urls import urlpatterns
+
+User = get_user_model()
+
+# Эти адреса меняют данные даже на GET, их не замеряем
+SKIPPED = {'add_comment', 'comment_delete', 'profile_follow',
+           'profile_unfollow', 'follow_bulk'}
+
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1] * 1000, 2)
+
+
+class Command(BaseCommand):
+    help = ('Замеряет время ответа и число запросов для каждого адреса '
+            'posts/urls.py и сохраняет результат в JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20,
+                            help='Сколько раз запрашивать каждый адрес')
+        parser.add_argument('--cold', action='store_true',
+                            help='Очищать кэш перед каждым запросом')
+        parser.add_argument('--output', help='Куда сохранить JSON')
+        parser.add_argument('--compare',
+                            help='JSON прошлого замера для сравнения')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 2:
+            raise CommandError('Нужно хотя бы два прогона')
+        samples, viewer = self.samples()
+        # Адрес не из INTERNAL_IPS, чтобы не включался debug toolbar.
+        client = Client(REMOTE_ADDR='192.0.2.1')
+        client.force_login(viewer)
+        results = {}
+        for pattern in urlpatterns:
+            name = pattern.name
+            if name is None or name in SKIPPED:
+                continue
+            url = reverse(name, kwargs={
+                key: samples[key] for key in pattern.pattern.converters
+            })
+            results[name] = self.measure(client, url, options)
+            self.stdout.write(
+                '{:<16} {:>8} ms p50 {:>8} ms p99 {:>4} запросов'.format(
+                    name, results[name]['p50_ms'], results[name]['p99_ms'],
+                    results[name]['queries_max']))
+        report = {
+            'created': timezone.now().isoformat(),
+            'runs': options['runs'],
+            'cold': options['cold'],
+            'rows': {model._meta.model_name: model.objects.count()
+                     for model in (User, Group, Post, Comment)},
+            'results': results,
+        }
+        output = options['output'] or 'benchmark-{}.json'.format(
+            timezone.now().strftime('%Y%m%d-%H%M%S'))
+        with open(output, 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        self.stdout.write(f'Результат сохранён в {output}')
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def samples(self):
+        """
+        Аргументы адресов: самый популярный автор, его запись с самым
+        большим числом комментариев, крупнейшее сообщество и читатель,
+        у которого больше всего подписок.
+        """
+        post = Post.objects.select_related('author').annotate(
+            followers=Count('author__following', distinct=True)
+        ).order_by('-followers', '-comments_count').first()
+        if post is None:
+            raise CommandError('В базе нет записей: запустите generate_data')
+        group = Group.objects.annotate(
+            size=Count('posts')).order_by('-size').first()
+        comment = Comment.objects.filter(post=post).first()
+        viewer = User.objects.annotate(
+            n=Count('follower')).order_by('-n').first()
+        samples = {
+            'username': post.author.username,
+            'post_id': post.pk,
+            'slug': group.slug if group else 'none',
+            'comment_id': comment.pk if comment else 0,
+        }
+        return samples, viewer
+
+    def measure(self, client, url, options):
+        client.get(url)
+        timings = []
+        queries = []
+        status = None
+        for _ in range(options['runs']):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = client.get(url)
+                timings.append(time.perf_counter() - started)
+            queries.append(len(captured.captured_queries))
+            status = response.status_code
+        quantiles = statistics.quantiles(timings, n=100, method='inclusive')
+        return {
+            'url': url,
+            'status': status,
+            'mean_ms': round(statistics.mean(timings) * 1000, 2),
+            'p50_ms': percentile(quantiles, 50),
+            'p90_ms': percentile(quantiles, 90),
+            'p99_ms': percentile(quantiles, 99),
+            'queries_min': min(queries),
+            'queries_max': max(queries),
+        }
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = json.load(file)['results']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            old = previous.get(name)
+            if old is None:
+                continue
+            change = (result['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100
+            self.stdout.write(
+                '{:<16} p50 {:+.1f}%  запросов {} -> {}'.format(
+                    name, change, old['queries_max'], result['queries_max']))
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from .benchmark import Command as Benchmark, percentile
+
+# Страницы, у которых есть асинхронные версии, и аргументы их адресов
+URL_ARGS = {
+    'profile': ('username',),
+    'post_detail': ('username', 'post_id'),
+}
+# Адрес не из INTERNAL_IPS, чтобы не включался debug toolbar
+REMOTE_ADDR = '192.0.2.1'
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность синхронных вью под WSGI '
+            'и асинхронных под ASGI при одновременных запросах')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200,
+                            help='Сколько запросов к каждому адресу')
+        parser.add_argument('--concurrency', type=int, default=16,
+                            help='Сколько запросов идёт одновременно')
+        parser.add_argument('--cold', action='store_true',
+                            help='Без кэша: каждая страница собирается '
+                                 'заново')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 2:
+            raise CommandError('Нужно хотя бы два запроса')
+        samples, _ = Benchmark().samples()
+        caches = DUMMY_CACHES if options['cold'] else None
+        results = {}
+        for name, keys in URL_ARGS.items():
+            url = reverse(name, kwargs={key: samples[key] for key in keys})
+            results[name] = {}
+            with override_settings(**({'CACHES': caches} if caches else {})):
+                with override_settings(ROOT_URLCONF='yatube.urls'):
+                    results[name]['wsgi'] = self.run_wsgi(url, options)
+                with override_settings(ROOT_URLCONF='yatube.urls_async'):
+                    results[name]['asgi'] = asyncio.run(
+                        self.run_asgi(url, options))
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, modes in results.items():
+            for mode, result in modes.items():
+                self.stdout.write(
+                    '{:<12} {}  {:>8.1f} запросов/с  p50 {:>8} ms  '
+                    'p99 {:>8} ms'.format(
+                        name, mode, result['requests_per_second'],
+                        result['p50_ms'], result['p99_ms']))
+
+    def run_wsgi(self, url, options):
+        local = threading.local()
+
+        def request():
+            if not hasattr(local, 'client'):
+                local.client = Client(REMOTE_ADDR=REMOTE_ADDR)
+            started = time.perf_counter()
+            response = local.client.get(url)
+            return response.status_code, time.perf_counter() - started
+
+        Client(REMOTE_ADDR=REMOTE_ADDR).get(url)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as pool:
+            timings = list(pool.map(lambda _: request(),
+                                    range(options['requests'])))
+        return summary(timings, time.perf_counter() - started)
+
+    async def run_asgi(self, url, options):
+        limit = asyncio.Semaphore(options['concurrency'])
+
+        async def request():
+            async with limit:
+                # Как в yatube/asgi.py: у каждого запроса свой поток
+                # для синхронного кода.
+                async with ThreadSensitiveContext():
+                    started = time.perf_counter()
+                    response = await AsyncClient(
+                        client=[REMOTE_ADDR, 0]).get(url)
+                    return (response.status_code,
+                            time.perf_counter() - started)
+
+        await request()
+        started = time.perf_counter()
+        timings = await asyncio.gather(
+            *(request() for _ in range(options['requests'])))
+        return summary(timings, time.perf_counter() - started)
+
+
+def summary(timings, elapsed):
+    statuses = sorted({status for status, _ in timings})
+    durations = [duration for _, duration in timings]
+    quantiles = statistics.quantiles(durations, n=100, method='inclusive')
+    return {
+        'statuses': statuses,
+        'requests_per_second': len(durations) / elapsed,
+        'p50_ms': percentile(quantiles, 50),
+        'p99_ms': percentile(quantiles, 99),
+    }
@@ -0,0 +1,216 @@
+import random
+from contextlib import contextmanager
+from datetime import timedelta
+from io import BytesIO
+
+from PIL import Image
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from posts import counters, feed, thumbnails
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+WORDS = (
+    'день вечер город дорога лес река море книга письмо дом окно свет '
+    'дождь снег утро друг работа поезд музыка кофе сад небо ветер '
+    'история память время встреча разговор мысль надежда путь'
+).split()
+
+
+@contextmanager
+def no_auto_now(*fields):
+    """
+    Временно отключает `auto_now_add`, чтобы сохранить свои даты.
+    """
+    saved = [field.auto_now_add for field in fields]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, value in zip(fields, saved):
+            field.auto_now_add = value
+
+
+def skewed_choices(rng, population, k, skew):
+    """
+    Выбор с весами по закону Ципфа: первые элементы
+    `population` выпадают намного чаще последних.
+    """
+    weights = [1 / (rank ** skew) for rank in range(1, len(population) + 1)]
+    return rng.choices(population, weights=weights, k=k)
+
+
+def sentence(rng, low, high):
+    return ' '.join(rng.choices(WORDS, k=rng.randint(low, high))).capitalize()
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, сообществами, '
+            'записями, комментариями и подписками')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=20000)
+        parser.add_argument('--comments', type=int, default=50000)
+        parser.add_argument(
+            '--follows', type=int, default=30,
+            help='Сколько в среднем авторов у одного подписчика',
+        )
+        parser.add_argument(
+            '--images', type=float, default=0.2,
+            help='Доля записей с картинкой',
+        )
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель Ципфа для популярности авторов и записей',
+        )
+        parser.add_argument('--days', type=int, default=365,
+                            help='За сколько дней распределить даты')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--prefix', default='gen',
+                            help='Префикс имён пользователей и слагов')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = options['prefix']
+        if User.objects.filter(
+                username__startswith=f'{self.prefix}_').exists():
+            raise CommandError(
+                f'Данные с префиксом {self.prefix} уже есть, '
+                f'укажите другой --prefix')
+        self.now = timezone.now()
+        self.days = options['days']
+        with transaction.atomic():
+            users = self.create_users(options['users'])
+            groups = self.create_groups(options['groups'])
+            images = self.create_images(5)
+            posts = self.create_posts(users, groups, images, options)
+            self.create_comments(users, posts, options)
+            self.create_follows(users, options)
+        # Записи созданы мимо сигналов: пересчитываем производные данные.
+        cache.clear()
+        # Картинки общие для многих записей, миниатюры достаточно
+        # создать по разу на файл.
+        for name in images:
+            thumbnails.make(name)
+        for _ in counters.rebuild_all(self.batch_size):
+            pass
+        self.stdout.write('Счётчики пересчитаны')
+        user_ids = [user.pk for user in users]
+        for start in range(0, len(user_ids), self.batch_size):
+            with transaction.atomic():
+                feed.rebuild(user_ids[start:start + self.batch_size])
+        self.stdout.write('Ленты подписок собраны')
+
+    def random_date(self):
+        return self.now - timedelta(seconds=self.rng.uniform(
+            0, self.days * 24 * 60 * 60))
+
+    def create_users(self, count):
+        # Хэш одного пароля на всех: хэширование — самая медленная часть.
+        password = make_password('password')
+        users = User.objects.bulk_create(
+            (User(username=f'{self.prefix}_user{i}',
+                  email=f'{self.prefix}_user{i}@example.com',
+                  password=password)
+             for i in range(count)),
+            batch_size=self.batch_size,
+        )
+        self.stdout.write(f'Пользователей: {len(users)}')
+        # bulk_create на SQLite не возвращает id, перечитываем.
+        return list(User.objects.filter(
+            username__startswith=f'{self.prefix}_user').order_by('pk'))
+
+    def create_groups(self, count):
+        Group.objects.bulk_create(
+            Group(title=f'Сообщество {i}',
+                  slug=f'{self.prefix}-group-{i}',
+                  description=sentence(self.rng, 5, 20))
+            for i in range(count)
+        )
+        self.stdout.write(f'Сообществ: {count}')
+        return list(Group.objects.filter(
+            slug__startswith=f'{self.prefix}-group-').order_by('pk'))
+
+    def create_images(self, count):
+        names = []
+        for i in range(count):
+            buffer = BytesIO()
+            color = tuple(self.rng.randrange(256) for _ in range(3))
+            Image.new('RGB', (1200, 800), color).save(buffer, 'JPEG')
+            names.append(default_storage.save(
+                f'posts/{self.prefix}_{i}.jpg', ContentFile(buffer.getvalue())
+            ))
+        return names
+
+    def create_posts(self, users, groups, images, options):
+        authors = skewed_choices(self.rng, users, options['posts'],
+                                 options['skew'])
+        posts = (
+            Post(
+                text=sentence(self.rng, 5, 60),
+                author=author,
+                group=(self.rng.choice(groups)
+                       if groups and self.rng.random() < 0.7 else None),
+                image=(self.rng.choice(images)
+                       if self.rng.random() < options['images'] else None),
+                pub_date=self.random_date(),
+            )
+            for author in authors
+        )
+        with no_auto_now(Post._meta.get_field('pub_date')):
+            Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        self.stdout.write(f'Записей: {options["posts"]}')
+        return list(Post.objects.filter(
+            author__username__startswith=f'{self.prefix}_user'
+        ).order_by('-pub_date').values_list('pk', 'pub_date'))
+
+    def create_comments(self, users, posts, options):
+        if not posts:
+            return
+        targets = skewed_choices(self.rng, posts, options['comments'],
+                                 options['skew'])
+        comments = (
+            Comment(
+                post_id=post_id,
+                author=self.rng.choice(users),
+                text=sentence(self.rng, 2, 30),
+                created=pub_date + (self.now - pub_date) * self.rng.random(),
+            )
+            for post_id, pub_date in targets
+        )
+        with no_auto_now(Comment._meta.get_field('created')):
+            Comment.objects.bulk_create(comments,
+                                        batch_size=self.batch_size)
+        self.stdout.write(f'Комментариев: {options["comments"]}')
+
+    def create_follows(self, users, options):
+        if len(users) < 2:
+            return
+        pairs = set()
+        for user in users:
+            count = min(len(users) - 1,
+                        int(self.rng.expovariate(1 / options['follows'])))
+            for author in skewed_choices(self.rng, users, count,
+                                         options['skew']):
+                if author.pk != user.pk:
+                    pairs.add((user.pk, author.pk))
+        Follow.objects.bulk_create(
+            (Follow(user_id=user_id, author_id=author_id)
+             for user_id, author_id in pairs),
+            batch_size=self.batch_size,
+            ignore_conflicts=True,
+        )
+        self.stdout.write(f'Подписок: {len(pairs)}')
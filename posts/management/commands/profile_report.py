@@ -0,0 +1,57 @@
+import io
+import os
+import pstats
+import statistics
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.middleware import make_profile_token, parse_profile_name
+
+
+class Command(BaseCommand):
+    help = ('Сводит сохранённые профили запросов в отчёт '
+            'о самых горячих функциях каждой вью')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None,
+                            help='Каталог профилей, по умолчанию '
+                                 'POSTS_PROFILE_DIR')
+        parser.add_argument('--top', type=int, default=15,
+                            help='Сколько функций выводить на вью')
+        parser.add_argument('--view', help='Только эта вью')
+        parser.add_argument('--sort', default='cumulative',
+                            choices=('cumulative', 'tottime', 'ncalls'))
+        parser.add_argument('--token', action='store_true',
+                            help='Вывести токен заголовка профилирования')
+
+    def handle(self, *args, **options):
+        if options['token']:
+            self.stdout.write(
+                f'{settings.POSTS_PROFILE_HEADER}: {make_profile_token()}')
+            return
+        directory = options['dir'] or settings.POSTS_PROFILE_DIR
+        if not os.path.isdir(directory):
+            self.stdout.write(f'Профилей нет: {directory}')
+            return
+        views = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith('.prof'):
+                continue
+            view_name, latency = parse_profile_name(name)
+            if options['view'] and view_name != options['view']:
+                continue
+            files, latencies = views.setdefault(view_name, ([], []))
+            files.append(os.path.join(directory, name))
+            latencies.append(latency)
+        for view_name, (files, latencies) in sorted(
+                views.items(), key=lambda item: -sum(item[1][1])):
+            self.stdout.write(
+                '{}: {} запросов, медиана {} мс, максимум {} мс'.format(
+                    view_name, len(files), statistics.median(latencies),
+                    max(latencies)))
+            stream = io.StringIO()
+            stats = pstats.Stats(*files, stream=stream)
+            stats.strip_dirs().sort_stats(options['sort']).print_stats(
+                options['top'])
+            self.stdout.write(stream.getvalue())
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики комментариев, записей и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк пересчитывать в одной транзакции',
+        )
+        parser.add_argument(
+            '--queue',
+            action='store_true',
+            help='Не пересчитывать сразу, а поставить пачки в очередь '
+                 'фоновых задач',
+        )
+
+    def handle(self, *args, **options):
+        done = {}
+        rebuild = (counters.queue_rebuild if options['queue']
+                   else counters.rebuild_all)
+        for model, size in rebuild(options['batch_size']):
+            name = model._meta.verbose_name_plural
+            done[name] = done.get(name, 0) + size
+        for name, size in done.items():
+            self.stdout.write(f'{name}: {size}')
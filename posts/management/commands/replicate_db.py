@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from posts.db import REPLICA, replicate
+
+
+class Command(BaseCommand):
+    help = ('Копирует основную базу SQLite в реплику для чтения '
+            'и сбрасывает кэш страниц, собранных по старой копии')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Повторять копирование каждые N секунд, 0 — один раз',
+        )
+
+    def handle(self, *args, **options):
+        if REPLICA not in connections.databases:
+            raise CommandError(
+                'Реплика не настроена: задайте YATUBE_REPLICA_PATH')
+        while True:
+            started = time.monotonic()
+            replicate()
+            elapsed = time.monotonic() - started
+            self.stdout.write(f'Реплика обновлена за {elapsed:.2f} с')
+            if options['interval'] <= 0:
+                return
+            time.sleep(max(0, options['interval'] - elapsed))
@@ -0,0 +1,65 @@
+import multiprocessing
+import time
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+
+import django
+from django.core.management.base import BaseCommand
+
+from posts import jobs
+
+
+class Command(BaseCommand):
+    help = ('Выполняет фоновые задачи из очереди в базе: миниатюры, '
+            'раскладку записей по лентам, пересчёт счётчиков')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='Сколько задач выполнять одновременно')
+        parser.add_argument(
+            '--executor', choices=('thread', 'process'), default='thread',
+            help='Потоки или отдельные процессы (для задач, нагружающих '
+                 'процессор)',
+        )
+        parser.add_argument('--poll', type=float, default=1,
+                            help='Сколько секунд ждать, когда задач нет')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и выйти')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        if options['executor'] == 'process':
+            # Новые процессы, а не fork: соединения с базой
+            # нельзя делить с родителем.
+            executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context('spawn'),
+                initializer=django.setup,
+            )
+        else:
+            executor = ThreadPoolExecutor(workers,
+                                          thread_name_prefix='jobs')
+        running = set()
+        done = 0
+        try:
+            while True:
+                if len(running) < workers:
+                    for job in jobs.claim(workers - len(running)):
+                        running.add(executor.submit(
+                            jobs.execute_in_worker, job.pk, job.claim))
+                if not running:
+                    if options['once']:
+                        break
+                    time.sleep(options['poll'])
+                    continue
+                finished, running = wait(running, timeout=options['poll'],
+                                         return_when=FIRST_COMPLETED)
+                for future in finished:
+                    future.result()
+                done += len(finished)
+        except KeyboardInterrupt:
+            # Недоделанные задачи вернутся в очередь по истечении
+            # POSTS_JOBS_VISIBILITY_TIMEOUT.
+            pass
+        finally:
+            executor.shutdown(wait=True)
+        self.stdout.write(f'Выполнено задач: {done}')
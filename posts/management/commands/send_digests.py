@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from posts import notifications
+
+
+class Command(BaseCommand):
+    help = ('Рассылает подписчикам дайджесты новых записей за прошедшие '
+            'окна; прерванная рассылка продолжается с места остановки. '
+            'Запускать по расписанию, не больше одной копии сразу')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Получателей в пачке, по умолчанию '
+                                 'POSTS_DIGEST_BATCH_SIZE')
+        parser.add_argument('--rate', type=float, default=None,
+                            help='Писем в секунду, 0 — без ограничения; '
+                                 'по умолчанию POSTS_DIGEST_RATE')
+
+    def handle(self, *args, **options):
+        totals = {}
+        for run, sent in notifications.send_digests(
+                batch_size=options['batch_size'], rate=options['rate']):
+            totals[run] = totals.get(run, 0) + sent
+        for run, sent in totals.items():
+            self.stdout.write(f'{run}: писем {sent}')
+        if not totals:
+            self.stdout.write('Новых окон нет')
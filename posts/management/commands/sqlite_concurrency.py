@@ -0,0 +1,132 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from posts.db import apply_pragmas
+
+# Как SQLite работает без настроек: журнал с откатом, полная синхронизация
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+}
+
+SCHEMA = '''
+    CREATE TABLE comment (
+        id INTEGER PRIMARY KEY,
+        post_id INTEGER NOT NULL,
+        author_id INTEGER NOT NULL,
+        text TEXT NOT NULL,
+        created REAL NOT NULL
+    );
+    CREATE INDEX comment_post_created ON comment (post_id, created);
+'''
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает пропускную способность SQLite при одновременных '
+            'чтениях и записях без настроек и с POSTS_SQLITE_PRAGMAS')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--posts', type=int, default=100)
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести результат в JSON')
+
+    def handle(self, *args, **options):
+        results = {}
+        for name, pragmas in (('default', DEFAULT_PRAGMAS),
+                              ('tuned', settings.POSTS_SQLITE_PRAGMAS)):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'bench.sqlite3')
+                results[name] = self.run(path, pragmas, options)
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for name, result in results.items():
+            self.stdout.write(
+                '{:<8} чтений/с {:>9.0f}  записей/с {:>8.0f}  '
+                'ошибок блокировки {}'.format(
+                    name, result['reads_per_second'],
+                    result['writes_per_second'], result['locked_errors']))
+
+    def connect(self, path, pragmas):
+        # Как у Django: ожидание блокировки 5 секунд по умолчанию.
+        connection = sqlite3.connect(path, timeout=5,
+                                     isolation_level=None,
+                                     check_same_thread=False)
+        apply_pragmas(connection.cursor(), pragmas)
+        return connection
+
+    def run(self, path, pragmas, options):
+        setup = self.connect(path, pragmas)
+        setup.executescript(SCHEMA)
+        setup.close()
+        counts = {'reads': 0, 'writes': 0, 'locked_errors': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['seconds']
+
+        def count(key):
+            with lock:
+                counts[key] += 1
+
+        def reader(number):
+            connection = self.connect(path, pragmas)
+            post_id = 0
+            while time.monotonic() < deadline:
+                post_id = (post_id + number + 1) % options['posts']
+                try:
+                    connection.execute(
+                        'SELECT id, author_id, text FROM comment '
+                        'WHERE post_id = ? ORDER BY created DESC LIMIT 20',
+                        [post_id]).fetchall()
+                    count('reads')
+                except sqlite3.OperationalError:
+                    count('locked_errors')
+            connection.close()
+
+        def writer(number):
+            connection = self.connect(path, pragmas)
+            written = 0
+            while time.monotonic() < deadline:
+                written += 1
+                try:
+                    connection.execute('BEGIN')
+                    connection.execute(
+                        'INSERT INTO comment (post_id, author_id, text, '
+                        'created) VALUES (?, ?, ?, ?)',
+                        [written % options['posts'], number,
+                         'Комментарий', time.time()])
+                    connection.execute('COMMIT')
+                    count('writes')
+                except sqlite3.OperationalError:
+                    if connection.in_transaction:
+                        connection.execute('ROLLBACK')
+                    count('locked_errors')
+            connection.close()
+
+        threads = (
+            [threading.Thread(target=reader, args=(i,))
+             for i in range(options['readers'])]
+            + [threading.Thread(target=writer, args=(i,))
+               for i in range(options['writers'])]
+        )
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+        return {
+            'pragmas': pragmas,
+            'reads_per_second': counts['reads'] / elapsed,
+            'writes_per_second': counts['writes'] / elapsed,
+            'locked_errors': counts['locked_errors'],
+        }
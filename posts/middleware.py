@@ -0,0 +1,196 @@
+import cProfile
+import logging
+import os
+import random
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryStats:
+    """
+    SQL-запросы одного запроса к сайту: сколько их, сколько они шли
+    и сколько повторов. Точки сохранения и PRAGMA не считаются: их
+    добавляют ATOMIC_REQUESTS и открытие соединения, а не код вью.
+    """
+
+    def __init__(self):
+        self.url_name = None
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.monotonic()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if 'SAVEPOINT' not in sql and not sql.startswith('PRAGMA'):
+                self.queries.append(
+                    (sql, params, time.monotonic() - started))
+
+    @contextmanager
+    def record(self):
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(self))
+            yield self
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def time_ms(self):
+        return sum(duration for _, _, duration in self.queries) * 1000
+
+    @property
+    def duplicates(self):
+        """
+        Сколько запросов точно повторили уже выполненный.
+        """
+        return self.count - len({(sql, repr(params))
+                                 for sql, params, _ in self.queries})
+
+    def similar(self):
+        """
+        Запросы, выполненные больше одного раза с разными параметрами, —
+        признак N+1: SQL -> сколько раз.
+        """
+        counts = Counter(sql for sql, _, _ in self.queries)
+        return {sql: n for sql, n in counts.items() if n > 1}
+
+    def over_budget(self, budget):
+        """
+        Что из `budget` (`queries`, `duplicates`, `time_ms`) превышено.
+        """
+        actual = {
+            'queries': self.count,
+            'duplicates': self.duplicates,
+            'time_ms': self.time_ms,
+        }
+        return [f'{key} {actual[key]:g} > {limit}'
+                for key, limit in budget.items() if actual[key] > limit]
+
+
+class QueryBudgetMiddleware:
+    """
+    Считает SQL-запросы каждого запроса к сайту и сверяет их с бюджетом
+    вью из POSTS_QUERY_BUDGETS (по имени адреса). Статистика доступна
+    в `response.query_stats`. Превышение бюджета в тестах
+    (POSTS_QUERY_BUDGET_STRICT) — исключение, в работе — предупреждение.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        with stats.record():
+            response = self.get_response(request)
+        match = request.resolver_match
+        stats.url_name = match.url_name if match else None
+        response.query_stats = stats
+        budget = settings.POSTS_QUERY_BUDGETS.get(stats.url_name)
+        problems = stats.over_budget(budget) if budget else None
+        if problems:
+            message = '{} ({}): {}; повторяются: {}'.format(
+                stats.url_name, request.path, ', '.join(problems),
+                stats.similar())
+            if settings.POSTS_QUERY_BUDGET_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning('Превышен бюджет запросов %s', message)
+        return response
+
+
+PROFILE_SALT = 'posts.profile'
+_profiling = threading.Lock()
+
+
+def make_profile_token():
+    """
+    Значение заголовка POSTS_PROFILE_HEADER, включающего профилирование.
+    """
+    return signing.dumps('profile', salt=PROFILE_SALT)
+
+
+def profile_name(view_name, latency_ms):
+    # Имя файла несёт метки: время, длительность запроса и вью.
+    return '{}-{}ms-{}.prof'.format(time.time_ns(), round(latency_ms),
+                                    view_name.replace(':', '.'))
+
+
+def parse_profile_name(name):
+    """
+    Обратно к (вью, длительность в мс) из имени файла профиля.
+    """
+    _, latency, view_name = name[:-len('.prof')].split('-', 2)
+    return view_name, int(latency[:-len('ms')])
+
+
+class ProfilerMiddleware:
+    """
+    Профилирует cProfile долю POSTS_PROFILE_SAMPLE_RATE запросов и запросы
+    с подписанным заголовком POSTS_PROFILE_HEADER. Профили пишутся
+    в POSTS_PROFILE_DIR, хранятся последние POSTS_PROFILE_KEEP штук.
+    Одновременно профилируется не больше одного запроса.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.wanted(request) or not _profiling.acquire(blocking=False):
+            return self.get_response(request)
+        try:
+            profiler = cProfile.Profile()
+            started = time.monotonic()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            latency_ms = (time.monotonic() - started) * 1000
+        finally:
+            _profiling.release()
+        match = request.resolver_match
+        view_name = match.view_name if match else 'unresolved'
+        try:
+            self.save(profiler, view_name, latency_ms)
+        except OSError:
+            logger.exception('Не удалось сохранить профиль %s', view_name)
+        return response
+
+    def wanted(self, request):
+        token = request.headers.get(settings.POSTS_PROFILE_HEADER)
+        if token:
+            try:
+                signing.loads(token, salt=PROFILE_SALT,
+                              max_age=settings.POSTS_PROFILE_TOKEN_MAX_AGE)
+                return True
+            except signing.BadSignature:
+                pass
+        rate = settings.POSTS_PROFILE_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+    def save(self, profiler, view_name, latency_ms):
+        directory = settings.POSTS_PROFILE_DIR
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(
+            os.path.join(directory, profile_name(view_name, latency_ms)))
+        names = sorted(name for name in os.listdir(directory)
+                       if name.endswith('.prof'))
+        for name in names[:-settings.POSTS_PROFILE_KEEP]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
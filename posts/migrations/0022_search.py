@@ -0,0 +1,51 @@
+from django.db import migrations
+
+TABLES = ('posts_post', 'posts_comment')
+
+CREATE = (
+    '''CREATE VIRTUAL TABLE {table}_fts USING fts5(
+        text, content='{table}', content_rowid='id', tokenize='unicode61'
+    )''',
+    '''CREATE TRIGGER {table}_fts_ai AFTER INSERT ON {table} BEGIN
+        INSERT INTO {table}_fts(rowid, text) VALUES (new.id, new.text);
+    END''',
+    '''CREATE TRIGGER {table}_fts_ad AFTER DELETE ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+    END''',
+    '''CREATE TRIGGER {table}_fts_au AFTER UPDATE OF text ON {table} BEGIN
+        INSERT INTO {table}_fts({table}_fts, rowid, text)
+        VALUES ('delete', old.id, old.text);
+        INSERT INTO {table}_fts(rowid, text) VALUES (new.id, new.text);
+    END''',
+    '''INSERT INTO {table}_fts({table}_fts) VALUES ('rebuild')''',
+)
+
+DROP = (
+    'DROP TRIGGER IF EXISTS {table}_fts_ai',
+    'DROP TRIGGER IF EXISTS {table}_fts_ad',
+    'DROP TRIGGER IF EXISTS {table}_fts_au',
+    'DROP TABLE IF EXISTS {table}_fts',
+)
+
+
+def run_for_tables(statements):
+    def run(apps, schema_editor):
+        # Полнотекстовый индекс есть только у SQLite (FTS5).
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for table in TABLES:
+            for statement in statements:
+                schema_editor.execute(statement.format(table=table))
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0021_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_tables(CREATE), run_for_tables(DROP)),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0024_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DigestRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('window_start', models.DateTimeField(verbose_name='Начало окна')),
+                ('window_end', models.DateTimeField(unique=True, verbose_name='Конец окна')),
+                ('last_user_id', models.PositiveIntegerField(default=0, verbose_name='Последний обработанный получатель')),
+                ('sent', models.PositiveIntegerField(default=0, verbose_name='Отправлено писем')),
+                ('finished', models.DateTimeField(blank=True, null=True, verbose_name='Завершена')),
+            ],
+            options={
+                'verbose_name': 'Рассылка дайджеста',
+                'verbose_name_plural': 'Рассылки дайджестов',
+                'ordering': ('-window_end',),
+            },
+        ),
+    ]
@@ -1,9 +1,35 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .cache import card_version
 
 User = get_user_model()
 
 
+class GroupQuerySet(models.QuerySet):
+    def with_stats(self):
+        """
+        Сообщества для каталога: число записей и последняя запись
+        (дата, id, начало текста, автор) приходят тем же запросом —
+        подзапросами по индексу (group, pub_date), а не запросом
+        на каждое сообщество.
+        """
+        posts = Post.objects.filter(group=OuterRef('pk')).order_by()
+        latest = posts.order_by('-pub_date', '-pk')
+        return self.annotate(
+            posts_count=Coalesce(Subquery(
+                posts.values('group').annotate(n=Count('pk')).values('n')
+            ), 0),
+            last_pub_date=Subquery(latest.values('pub_date')[:1]),
+            last_post_id=Subquery(latest.values('pk')[:1]),
+            last_post_text=Subquery(latest.values('text')[:1]),
+            last_post_author=Subquery(latest.values('author__username')[:1]),
+        )
+
+
 class Group(models.Model):
     title = models.CharField(
         max_length=200,
@@ -17,6 +43,8 @@ class Group(models.Model):
         verbose_name='Описание',
     )
 
+    objects = GroupQuerySet.as_manager()
+
     def __str__(self):
         return self.title
 
@@ -25,6 +53,15 @@ class Group(models.Model):
         verbose_name_plural = 'Сообщества'
 
 
+class PostQuerySet(models.QuerySet):
+    def for_feed(self):
+        """
+        Записи для карточек ленты: автор и сообщество приходят
+        тем же запросом, число комментариев хранится в самой записи.
+        """
+        return self.select_related('author', 'group')
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(
@@ -52,12 +89,37 @@ class Post(models.Model):
         null=True,
         verbose_name='Изображение',
     )
+    comments_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Комментариев',
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=[
+                    'author',
+                    'pub_date'
+                ],
+                name='post_author_pub_date_idx'),
+            models.Index(
+                fields=[
+                    'group',
+                    'pub_date'
+                ],
+                name='post_group_pub_date_idx'),
+        ]
         verbose_name = 'Запись'
         verbose_name_plural = 'Записи'
 
+    @property
+    def card_version(self):
+        return card_version(self)
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -82,6 +144,14 @@ class Comment(models.Model):
 
     class Meta:
         ordering = ('-created',)
+        indexes = [
+            models.Index(
+                fields=[
+                    'post',
+                    'created'
+                ],
+                name='comment_post_created_idx')
+        ]
         verbose_name = 'Комментарий'
         verbose_name_plural = 'Комментарии'
 
@@ -111,3 +181,186 @@ class Follow(models.Model):
         ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+
+
+class FeedItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Читатель',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Запись',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации',
+    )
+
+    class Meta:
+        ordering = ('-pub_date',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'user',
+                    'post'
+                ],
+                name='unique_feed_item')
+        ]
+        indexes = [
+            models.Index(
+                fields=[
+                    'user',
+                    'pub_date',
+                    'post'
+                ],
+                name='feed_user_pub_date_post_idx')
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+
+
+class UserStats(models.Model):
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Записей',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписчиков',
+    )
+    following_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Подписок',
+    )
+
+    class Meta:
+        indexes = [
+            # Популярные авторы для ленты подписок
+            models.Index(fields=['followers_count'],
+                         name='userstats_followers_idx'),
+        ]
+        verbose_name = 'Статистика пользователя'
+        verbose_name_plural = 'Статистика пользователей'
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (FAILED, 'Не выполнена'),
+    )
+
+    task = models.CharField(
+        max_length=200,
+        verbose_name='Функция',
+    )
+    args = models.JSONField(
+        default=list,
+        verbose_name='Аргументы',
+    )
+    dedup_key = models.CharField(
+        max_length=200,
+        blank=True,
+        null=True,
+        verbose_name='Ключ дедупликации',
+    )
+    state = models.CharField(
+        max_length=10,
+        choices=STATES,
+        default=QUEUED,
+        verbose_name='Состояние',
+    )
+    attempts = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Попыток',
+    )
+    max_attempts = models.PositiveIntegerField(
+        verbose_name='Максимум попыток',
+    )
+    run_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Выполнить не раньше',
+    )
+    claim = models.CharField(
+        max_length=32,
+        blank=True,
+        null=True,
+        verbose_name='Метка исполнителя',
+    )
+    last_error = models.TextField(
+        blank=True,
+        verbose_name='Последняя ошибка',
+    )
+    created = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана',
+    )
+
+    class Meta:
+        ordering = ('run_at',)
+        constraints = [
+            models.UniqueConstraint(
+                fields=[
+                    'dedup_key'
+                ],
+                condition=models.Q(state='queued'),
+                name='unique_queued_job')
+        ]
+        indexes = [
+            models.Index(
+                fields=[
+                    'state',
+                    'run_at'
+                ],
+                name='job_state_run_at_idx')
+        ]
+        verbose_name = 'Фоновая задача'
+        verbose_name_plural = 'Фоновые задачи'
+
+    def __str__(self):
+        return f'{self.task}{tuple(self.args)}'
+
+
+class DigestRun(models.Model):
+    window_start = models.DateTimeField(
+        verbose_name='Начало окна',
+    )
+    window_end = models.DateTimeField(
+        unique=True,
+        verbose_name='Конец окна',
+    )
+    last_user_id = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Последний обработанный получатель',
+    )
+    sent = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Отправлено писем',
+    )
+    finished = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Завершена',
+    )
+
+    class Meta:
+        ordering = ('-window_end',)
+        verbose_name = 'Рассылка дайджеста'
+        verbose_name_plural = 'Рассылки дайджестов'
+
+    def __str__(self):
+        return f'{self.window_start:%Y-%m-%d %H:%M} — {self.window_end:%H:%M}'
@@ -0,0 +1,154 @@
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sites.models import Site
+from django.core.mail import get_connection, send_mass_mail
+from django.db import connection
+from django.db.models import F
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+from .models import DigestRun, Follow, Post
+
+User = get_user_model()
+
+SUBJECT = 'Новые записи авторов, на которых вы подписаны'
+
+
+def window_end(now=None):
+    """
+    Конец последнего целиком прошедшего окна POSTS_DIGEST_WINDOW.
+    """
+    window = settings.POSTS_DIGEST_WINDOW
+    now = now or timezone.now()
+    return datetime.fromtimestamp(now.timestamp() // window * window,
+                                  tz=dt_timezone.utc)
+
+
+def next_run(now=None):
+    """
+    Рассылка, которую нужно отправить: прерванная или новая за окно,
+    закончившееся к `now`. Окна, пропущенные между запусками, уходят
+    одним письмом. None, если всё уже отправлено.
+    """
+    unfinished = DigestRun.objects.filter(
+        finished__isnull=True).order_by('window_end').first()
+    if unfinished is not None:
+        return unfinished
+    end = window_end(now)
+    last = DigestRun.objects.order_by('-window_end').first()
+    if last is not None and last.window_end >= end:
+        return None
+    start = (last.window_end if last is not None
+             else end - timedelta(seconds=settings.POSTS_DIGEST_WINDOW))
+    return DigestRun.objects.create(window_start=start, window_end=end)
+
+
+def recipients(run, batch_size):
+    """
+    Следующая пачка подписчиков с почтой после последнего обработанного.
+    """
+    return list(User.objects.filter(
+        pk__gt=run.last_user_id, follower__isnull=False,
+    ).exclude(email='').distinct().order_by('pk')[:batch_size])
+
+
+NEW_POSTS_SQL = '''
+    SELECT recipient, post_id, total FROM (
+        SELECT follow.user_id AS recipient, post.id AS post_id,
+               ROW_NUMBER() OVER (
+                   PARTITION BY follow.user_id ORDER BY post.pub_date DESC
+               ) AS position,
+               COUNT(*) OVER (PARTITION BY follow.user_id) AS total
+        FROM {follow} follow
+        JOIN {post} post ON post.author_id = follow.author_id
+        WHERE follow.user_id IN ({users})
+          AND post.pub_date > %s AND post.pub_date <= %s
+    ) digest
+    WHERE position <= %s
+    ORDER BY recipient, position
+'''
+
+
+def new_posts(run, user_ids, limit):
+    """
+    Записи окна рассылки от авторов, на которых подписаны получатели:
+    id получателя -> (не больше `limit` новых записей, сколько их всего).
+    Лишние записи отсекает сама база.
+    """
+    sql = NEW_POSTS_SQL.format(
+        follow=Follow._meta.db_table,
+        post=Post._meta.db_table,
+        users=', '.join(['%s'] * len(user_ids)),
+    )
+    # Сырой запрос не приводит даты сам: aware-дату драйвер SQLite
+    # записал бы со смещением, и сравнение строк с pub_date сломалось бы.
+    adapt = connection.ops.adapt_datetimefield_value
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [*user_ids, adapt(run.window_start),
+                             adapt(run.window_end), limit])
+        rows = cursor.fetchall()
+    posts = Post.objects.select_related('author').in_bulk(
+        {post_id for _, post_id, _ in rows})
+    digests = {}
+    for recipient, post_id, total in rows:
+        digests.setdefault(recipient, ([], total))[0].append(posts[post_id])
+    return digests
+
+
+def messages(users, digests, domain):
+    for user in users:
+        if user.pk not in digests:
+            continue
+        posts, total = digests[user.pk]
+        body = render_to_string('posts/email/digest.txt', {
+            'user': user,
+            'posts': posts,
+            'more': total - len(posts),
+            'domain': domain,
+        })
+        yield SUBJECT, body, None, [user.email]
+
+
+def send_digests(now=None, batch_size=None, rate=None):
+    """
+    Рассылает подписчикам дайджесты новых записей: одному получателю
+    не больше одного письма за окно POSTS_DIGEST_WINDOW.
+
+    Получатели обрабатываются пачками по `batch_size`, каждая пачка
+    уходит одним `send_mass_mail` через общее на всю рассылку соединение
+    и не быстрее `rate` писем в секунду. После пачки `DigestRun` запоминает
+    последнего получателя, и прерванная рассылка продолжается с него;
+    пачка, отправленная прямо перед сбоем, может прийти повторно.
+    Выдаёт пары (рассылка, отправлено писем).
+    """
+    batch_size = batch_size or settings.POSTS_DIGEST_BATCH_SIZE
+    rate = settings.POSTS_DIGEST_RATE if rate is None else rate
+    domain = Site.objects.get_current().domain
+    with get_connection() as connection:
+        while True:
+            run = next_run(now)
+            if run is None:
+                return
+            while True:
+                users = recipients(run, batch_size)
+                if not users:
+                    break
+                started = time.monotonic()
+                batch = list(messages(users, new_posts(
+                    run, [user.pk for user in users],
+                    settings.POSTS_DIGEST_MAX_POSTS), domain))
+                sent = 0
+                if batch:
+                    sent = send_mass_mail(batch, connection=connection)
+                run.last_user_id = users[-1].pk
+                DigestRun.objects.filter(pk=run.pk).update(
+                    last_user_id=run.last_user_id, sent=F('sent') + sent)
+                yield run, sent
+                if rate:
+                    time.sleep(max(
+                        0, sent / rate - (time.monotonic() - started)))
+            DigestRun.objects.filter(pk=run.pk).update(
+                finished=timezone.now())
@@ -0,0 +1,271 @@
+import asyncio
+import base64
+import binascii
+
+from django.core.paginator import (EmptyPage, InvalidPage, PageNotAnInteger,
+                                   Paginator)
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .db import run_query
+
+PER_PAGE = 10
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(value, pk):
+    """
+    Упаковывает пару (значение поля сортировки, id) в непрозрачный токен.
+    """
+    raw = f'{value.isoformat()}|{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Распаковывает токен курсора обратно в пару (datetime, id).
+    """
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        value, pk = raw.decode().split('|')
+        value = parse_datetime(value)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor(token)
+    if value is None:
+        raise InvalidCursor(token)
+    return value, pk
+
+
+class CursorPage:
+    """
+    Страница курсорной пагинации. Повторяет интерфейс `Page`,
+    который используется в шаблонах.
+    """
+
+    def __init__(self, object_list, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return None
+        return self.paginator.cursor_for(self.object_list[0])
+
+
+class CursorPaginator:
+    """
+    Пагинация по ключу (`field`, `key`): каждая страница — это один проход
+    по индексу от курсора, без COUNT(*) и OFFSET. `key` различает строки
+    с одинаковым `field`; по умолчанию это id.
+    """
+
+    def __init__(self, object_list, per_page, field='pub_date', key='pk'):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.field = field
+        self.key = key
+
+    def cursor_for(self, obj):
+        if isinstance(obj, dict):
+            # Строка из `values()`
+            return encode_cursor(obj[self.field], obj[self.key])
+        return encode_cursor(getattr(obj, self.field), getattr(obj, self.key))
+
+    def _ordered(self, descending=True):
+        sign = '-' if descending else ''
+        return self.object_list.order_by(f'{sign}{self.field}',
+                                         f'{sign}{self.key}')
+
+    def first_page(self):
+        items = list(self._ordered()[:self.per_page + 1])
+        return CursorPage(items[:self.per_page], self,
+                          has_next=len(items) > self.per_page,
+                          has_previous=False)
+
+    def page_after(self, token):
+        value, pk = decode_cursor(token)
+        after = (Q(**{f'{self.field}__lt': value})
+                 | Q(**{self.field: value, f'{self.key}__lt': pk}))
+        items = list(self._ordered().filter(after)[:self.per_page + 1])
+        return CursorPage(items[:self.per_page], self,
+                          has_next=len(items) > self.per_page,
+                          has_previous=True)
+
+    def page_before(self, token):
+        value, pk = decode_cursor(token)
+        before = (Q(**{f'{self.field}__gt': value})
+                  | Q(**{self.field: value, f'{self.key}__gt': pk}))
+        items = list(
+            self._ordered(descending=False).filter(before)[:self.per_page + 1]
+        )
+        if not items:
+            return self.first_page()
+        has_previous = len(items) > self.per_page
+        items = items[:self.per_page]
+        items.reverse()
+        return CursorPage(items, self, has_next=True,
+                          has_previous=has_previous)
+
+
+def paginate(request, object_list, per_page=PER_PAGE, field='pub_date',
+             key='pk', count=None):
+    """
+    Возвращает пару (paginator, page) для ленты.
+
+    Если в запросе есть `?after=` или `?before=`, страница строится
+    курсором по (`field`, `key`). Иначе используется обычный `Paginator`
+    с номером страницы из `?page=`, а ссылки «вперёд/назад» у страницы
+    всё равно получают курсоры, чтобы дальнейшая навигация шла по индексу,
+    а дальние страницы читаются с ближнего края ленты (`page_items`).
+    Число записей `count`, если известно заранее (например, из счётчика),
+    избавляет `Paginator` от COUNT(*).
+    """
+    object_list = object_list.order_by(f'-{field}', f'-{key}')
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if after or before:
+        paginator = CursorPaginator(object_list, per_page, field, key)
+        try:
+            if after:
+                return paginator, paginator.page_after(after)
+            return paginator, paginator.page_before(before)
+        except InvalidCursor:
+            return paginator, paginator.first_page()
+    paginator = Paginator(object_list, per_page)
+    if count is not None:
+        paginator.count = count
+    page = get_page(paginator, request.GET.get('page'))
+    page.object_list = page_items(page, object_list, field, key)
+    if count and not page.object_list:
+        # Счётчик разошёлся с лентой и обещает больше записей, чем есть:
+        # эту страницу строим по настоящему COUNT(*).
+        paginator = Paginator(object_list, per_page)
+        page = get_page(paginator, request.GET.get('page'))
+        page.object_list = page_items(page, object_list, field, key)
+    add_cursors(page, CursorPaginator(object_list, per_page, field, key))
+    return paginator, page
+
+
+async def paginate_async(request, object_list, per_page=PER_PAGE,
+                         field='pub_date', key='pk', count=None):
+    """
+    `paginate` для асинхронных вью: страница записей и COUNT(*)
+    для `Paginator` выбираются параллельно. Если номер из `?page=`
+    оказался за пределами ленты, нужная страница читается вторым
+    запросом, когда число записей уже известно. С готовым `count`
+    COUNT(*) не выполняется.
+    """
+    if count is not None or request.GET.get('after') or request.GET.get(
+            'before'):
+        return await run_query(paginate, request, object_list, per_page,
+                               field, key, count)
+    object_list = object_list.order_by(f'-{field}', f'-{key}')
+    try:
+        guess = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        guess = 1
+    offset = (guess - 1) * per_page
+    count, items = await asyncio.gather(
+        run_query(object_list.count),
+        run_query(list, object_list[offset:offset + per_page]),
+    )
+    paginator = Paginator(object_list, per_page)
+    paginator.count = count
+    page = get_page(paginator, request.GET.get('page'))
+    if page.number == guess:
+        page.object_list = items
+    else:
+        page.object_list = await run_query(page_items, page, object_list,
+                                           field, key)
+    add_cursors(page, CursorPaginator(object_list, per_page, field, key))
+    return paginator, page
+
+
+def add_cursors(page, cursors):
+    """
+    Курсоры ссылок «вперёд/назад» страницы `Paginator`. У пустой
+    страницы их нет, ссылки остаются с номерами.
+    """
+    if not page.object_list:
+        return
+    if page.has_next():
+        page.next_cursor = cursors.cursor_for(page.object_list[-1])
+    if page.has_previous():
+        page.previous_cursor = cursors.cursor_for(page.object_list[0])
+
+
+def page_items(page, object_list, field, key):
+    """
+    Записи страницы `Paginator`. Страницы второй половины ленты читаются
+    с её старого конца, по возрастанию (`field`, `key`): OFFSET тогда
+    отсчитывается от ближнего края, и для последней страницы он нулевой.
+    """
+    start = (page.number - 1) * page.paginator.per_page
+    end = min(start + page.paginator.per_page, page.paginator.count)
+    from_end = page.paginator.count - end
+    if from_end >= start:
+        return list(page.object_list)
+    items = list(object_list.order_by(field, key)[from_end:from_end
+                                                  + end - start])
+    items.reverse()
+    return items
+
+
+def cursor_page(request, object_list, per_page, field):
+    """
+    Страница только курсорной пагинации: первая или после `?after=`.
+    """
+    paginator = CursorPaginator(object_list, per_page, field)
+    after = request.GET.get('after')
+    if after:
+        try:
+            return paginator.page_after(after)
+        except InvalidCursor:
+            pass
+    return paginator.first_page()
+
+
+def get_page(paginator, page_number):
+    try:
+        page = paginator.page(page_number)
+    except PageNotAnInteger:
+        page = paginator.page(1)
+    except EmptyPage:
+        page = paginator.page(paginator.num_pages)
+    except InvalidPage:
+        page = paginator.page(1)
+    return page
@@ -0,0 +1,83 @@
+import re
+
+from django.db import connection
+from django.db.models.expressions import RawSQL
+
+from .models import Post
+
+# Совпадение в комментарии весит меньше совпадения в тексте записи.
+COMMENT_WEIGHT = 0.5
+
+RANKED_SQL = '''
+    SELECT post_id, MIN(score) AS score FROM (
+        SELECT rowid AS post_id, bm25(posts_post_fts) AS score
+        FROM posts_post_fts
+        WHERE posts_post_fts MATCH %s
+        UNION ALL
+        SELECT posts_comment.post_id,
+               bm25(posts_comment_fts) * {weight} AS score
+        FROM posts_comment_fts
+        JOIN posts_comment ON posts_comment.id = posts_comment_fts.rowid
+        WHERE posts_comment_fts MATCH %s
+    )
+    GROUP BY post_id
+'''.format(weight=COMMENT_WEIGHT)
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def fts_query(text):
+    """
+    Превращает ввод пользователя в запрос FTS5: каждое слово
+    берётся в кавычки, чтобы операторы FTS не ломали запрос.
+    """
+    words = re.findall(r'\w+', text)
+    return ' '.join(f'"{word}"' for word in words)
+
+
+class SearchResults:
+    """
+    Записи, найденные по тексту и комментариям, в порядке релевантности.
+    Поддерживает `count()` и срезы, поэтому подходит для `Paginator`.
+    """
+
+    def __init__(self, text):
+        self.query = fts_query(text)
+
+    def count(self):
+        if not self.query:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT COUNT(*) FROM ({RANKED_SQL})',
+                           [self.query, self.query])
+            return cursor.fetchone()[0]
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError('SearchResults supports only slicing')
+        if not self.query:
+            return []
+        start = index.start or 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'{RANKED_SQL} ORDER BY score, post_id DESC LIMIT %s OFFSET %s',
+                [self.query, self.query, index.stop - start, start]
+            )
+            ids = [row[0] for row in cursor.fetchall()]
+        posts = Post.objects.for_feed().in_bulk(ids)
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def filter_posts(queryset, text):
+    """
+    Оставляет в `queryset` записи, в тексте которых есть все слова `text`.
+    """
+    query = fts_query(text)
+    if not query:
+        return queryset
+    return queryset.filter(pk__in=RawSQL(
+        'SELECT rowid FROM posts_post_fts WHERE posts_post_fts MATCH %s',
+        [query]
+    ))
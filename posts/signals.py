@@ -0,0 +1,128 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import (post_delete, post_save, pre_delete,
+                                      pre_save)
+from django.dispatch import receiver
+
+from . import cache, counters, db, feed, thumbnails
+from .models import Comment, Follow, Group, Post
+
+# Записи, которые сейчас удаляются. Их комментарии удаляются каскадом
+# раньше самой записи, и пересчитывать для каждого счётчик и кэш
+# записи незачем: всё это сбросит `post_deleted`.
+_deleting_posts = set()
+
+
+@receiver(pre_save, sender=Post)
+def post_changing(sender, instance, **kwargs):
+    instance._old_image = None
+    instance._old_group_id = None
+    if instance.pk is None:
+        return
+    old = Post.objects.filter(pk=instance.pk).values(
+        'group', 'group__slug', 'image').first()
+    if old is None:
+        return
+    instance._old_image = old['image']
+    instance._old_group_id = old['group']
+    if old['group__slug'] is not None:
+        cache.bump(f'group_page:{old["group__slug"]}', 'group_list')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, posts_count=1)
+        counters.change_feed_counts(1, *counters.feed_scopes(
+            instance.group_id))
+        feed.fan_out(instance)
+    else:
+        cache.bump(f'post:{instance.pk}')
+        if instance.group_id != instance._old_group_id:
+            if instance._old_group_id is not None:
+                counters.change_feed_counts(
+                    -1, f'group:{instance._old_group_id}')
+            if instance.group_id is not None:
+                counters.change_feed_counts(1, f'group:{instance.group_id}')
+    cache.bump(*cache.page_scopes(instance))
+    if instance.group_id is not None:
+        cache.bump('group_list')
+    if instance.image and instance.image.name != instance._old_image:
+        thumbnails.queue(instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def post_deleting(sender, instance, **kwargs):
+    _deleting_posts.add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    _deleting_posts.discard(instance.pk)
+    cache.bump(f'post:{instance.pk}')
+    counters.change_user_stats(instance.author_id, posts_count=-1)
+    counters.change_feed_counts(-1, *counters.feed_scopes(instance.group_id))
+    cache.bump(*cache.page_scopes(instance))
+    if instance.group_id is not None:
+        cache.bump('group_list')
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, **kwargs):
+    if created:
+        counters.change_comments_count(instance.post_id, 1)
+    cache.bump(f'post:{instance.post_id}', *cache.page_scopes(instance.post))
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    if instance.post_id in _deleting_posts:
+        return
+    counters.change_comments_count(instance.post_id, -1)
+    # Автор и сообщество нужны для областей кэша: одним запросом
+    post = Post.objects.select_related('author', 'group').filter(
+        pk=instance.post_id).first()
+    if post is not None:
+        cache.bump(f'post:{post.pk}', *cache.page_scopes(post))
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, created, **kwargs):
+    if created:
+        cache.bump('group_list')
+    else:
+        cache.bump(f'group:{instance.pk}', 'groups')
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    # Записи сообщества остаются без него: меняются их карточки
+    # и все страницы, где сообщество выводилось.
+    cache.bump('groups', 'group_list', f'group_page:{instance.slug}',
+               f'group:{instance.pk}')
+
+
+@receiver(post_save, sender=Follow)
+def follow_created(sender, instance, created, **kwargs):
+    if created:
+        counters.change_user_stats(instance.author_id, followers_count=1)
+        counters.change_user_stats(instance.user_id, following_count=1)
+        feed.backfill(instance.user_id, instance.author_id)
+        cache.bump(f'profile:{instance.author.username}',
+                   f'profile:{instance.user.username}')
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    counters.change_user_stats(instance.author_id, followers_count=-1)
+    counters.change_user_stats(instance.user_id, following_count=-1)
+    feed.remove(instance.user_id, instance.author_id)
+    cache.bump(f'profile:{instance.author.username}',
+               f'profile:{instance.user.username}')
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            db.apply_pragmas(cursor, settings.POSTS_SQLITE_PRAGMAS)
@@ -0,0 +1,45 @@
+from django import template
+from django.core.cache.utils import make_template_fragment_key
+
+from posts.cache import get_or_compute
+
+register = template.Library()
+
+
+class CacheLockedNode(template.Node):
+    def __init__(self, nodelist, expire_time_var, fragment_name, vary_on):
+        self.nodelist = nodelist
+        self.expire_time_var = expire_time_var
+        self.fragment_name = fragment_name
+        self.vary_on = vary_on
+
+    def render(self, context):
+        timeout = self.expire_time_var.resolve(context)
+        vary_on = [var.resolve(context) for var in self.vary_on]
+        key = make_template_fragment_key(self.fragment_name, vary_on)
+        return get_or_compute(key, lambda: self.nodelist.render(context),
+                              timeout)
+
+
+@register.tag
+def cache_locked(parser, token):
+    """
+    Как `{% cache %}`, но фрагмент пересчитывается через `get_or_compute`:
+
+        {% cache_locked 500 sidebar request.user.username %}
+            .. some expensive processing ..
+        {% endcache_locked %}
+    """
+    nodelist = parser.parse(('endcache_locked',))
+    parser.delete_first_token()
+    tokens = token.split_contents()
+    if len(tokens) < 3:
+        raise template.TemplateSyntaxError(
+            f"'{tokens[0]}' tag requires at least 2 arguments."
+        )
+    return CacheLockedNode(
+        nodelist,
+        parser.compile_filter(tokens[1]),
+        tokens[2],
+        [parser.compile_filter(token) for token in tokens[3:]],
+    )
@@ -0,0 +1,21 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def page_window(page, neighbours=2):
+    """
+    Номера страниц для навигации: первая, последняя и `neighbours`
+    соседних с текущей с каждой стороны. Пропуски между ними
+    обозначены None.
+    """
+    last = page.paginator.num_pages
+    shown = {1, last, *range(max(page.number - neighbours, 1),
+                             min(page.number + neighbours, last) + 1)}
+    numbers = []
+    for number in sorted(shown):
+        if numbers and number - numbers[-1] > 1:
+            numbers.append(None)
+        numbers.append(number)
+    return numbers
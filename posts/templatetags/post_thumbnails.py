@@ -0,0 +1,17 @@
+from django import template
+
+from posts import thumbnails
+
+register = template.Library()
+
+
+@register.simple_tag
+def existing_thumbnail(image, size):
+    """
+    Готовая миниатюра размера `size` из `thumbnails.SIZES` или None,
+    пока фоновая задача её не создала: картинка никогда
+    не обрабатывается во время рендера.
+    """
+    if not image:
+        return None
+    return thumbnails.lookup(image, size)
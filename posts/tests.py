@@ -1,9 +1,40 @@
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import warnings
+from datetime import timedelta, timezone as dt_timezone
+from io import BytesIO, StringIO
+
+from PIL import Image
+from django.conf import settings
+from django.core import mail
 from django.core.cache import cache
+from django.core.management import call_command
+from django.core.paginator import Paginator
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import TestCase, Client
+from django.db import (OperationalError, connection, connections,
+                       transaction)
+from django.test import (TestCase, TransactionTestCase, Client,
+                         AsyncClient, override_settings)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
-from posts.models import Post, Group, User, Follow, Comment
+from posts import feed, jobs, notifications, thumbnails
+from posts.cache import (LOCK_KEY, VERSION_KEY, get_or_compute,
+                         get_versions)
+from posts.cache_backends import SharedFileCache
+from posts.checks import replica_cache_check
+from posts.db import REPLICA, STICKY_COOKIE, reading_replica, replicate
+from posts.middleware import QueryBudgetExceeded, QueryStats
+from posts.models import (Post, Group, User, Follow, Comment, DigestRun,
+                          FeedItem, Job, UserStats)
+from posts.pagination import encode_cursor
+from posts.templatetags.post_pagination import page_window
 
 
 class ModelsTest(TestCase):
@@ -305,27 +336,67 @@ class ModelsTest(TestCase):
 
     def test_cache(self):
         """
-        Тест, который проверяет работу кэша
+        Тест, который проверяет работу кэша: страница отдаётся из кэша,
+        пока записи не меняются, и обновляется сразу после новой записи.
         """
+        cache.clear()
         response_before = self.client.get(self.INDEX)
-        post = Post.objects.create(
-            text="new",
-            author=self.user,
-            group=self.group,
-        )
+        Post.objects.filter(pk=self.post.pk).update(text="changed silently")
         response_after = self.client.get(self.INDEX)
         self.assertEqual(
             response_before.content,
             response_after.content,
-            msg='Страница изменилась после добавления поста'
+            msg='Страница не взята из кэша'
+        )
+        post = Post.objects.create(
+            text="new",
+            author=self.user,
+            group=self.group,
         )
-        cache.clear()
         index = self.client.get(self.INDEX)
         self.assertEqual(
             index.context['page'][0],
             post,
-            msg='Пост не появился после очитски кэша'
+            msg='Пост не появился после добавления'
+        )
+
+    def test_page_cache_scopes(self):
+        """
+        Новая запись сбрасывает кэш страниц своей группы и автора,
+        но не чужих.
+        """
+        cache.clear()
+        for url in (self.POST_GROUP, self.PROFILE, self.PROFILE2):
+            self.client.get(url)
+        Post.objects.create(
+            text="new",
+            author=self.user,
+            group=self.group,
         )
+        for url, refreshed in ((self.POST_GROUP, True),
+                               (self.PROFILE, True),
+                               (self.PROFILE2, False)):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(
+                    response.context is not None,
+                    refreshed,
+                    msg='Кэш страницы сброшен неверно'
+                )
+
+    def test_group_delete_resets_pages(self):
+        """
+        Удаление сообщества сбрасывает кэш страниц, где оно выводилось.
+        """
+        cache.clear()
+        for url in (self.INDEX, self.POST_GROUP, self.PROFILE,
+                    self.POST_DETAIL):
+            self.client.get(url)
+        self.group.delete()
+        for url in (self.INDEX, self.PROFILE, self.POST_DETAIL):
+            with self.subTest(url=url):
+                self.assertNotContains(self.client.get(url), self.POST_GROUP)
+        self.assertEqual(self.client.get(self.POST_GROUP).status_code, 404)
 
     def test_follow(self):
         """
@@ -428,3 +499,1654 @@ class ModelsTest(TestCase):
             'test comment',
             'Комментарий не найден на странице'
         )
+
+
+class CursorPaginationTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.user = User.objects.create_user(username="Paginated")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        Post.objects.bulk_create(
+            Post(text=f"Post {i}", author=self.user, group=self.group)
+            for i in range(25)
+        )
+        self.posts = list(Post.objects.order_by('-pub_date', '-pk'))
+        self.URLS = (
+            reverse('index'),
+            reverse('group', args=[self.group.slug]),
+            reverse('profile', args=[self.user.username]),
+        )
+
+    def test_cursor_walk(self):
+        """
+        Переход по курсорам вперёд и назад отдаёт те же записи,
+        что и постраничная навигация.
+        """
+        for url in self.URLS:
+            with self.subTest(url=url):
+                page = self.client.get(url).context['page']
+                self.assertEqual(list(page), self.posts[:10])
+
+                page = self.client.get(
+                    url, {'after': page.next_cursor}).context['page']
+                self.assertEqual(list(page), self.posts[10:20])
+                self.assertTrue(page.has_previous())
+
+                last = self.client.get(
+                    url, {'after': page.next_cursor}).context['page']
+                self.assertEqual(list(last), self.posts[20:])
+                self.assertFalse(last.has_next())
+
+                back = self.client.get(
+                    url, {'before': page.previous_cursor}).context['page']
+                self.assertEqual(list(back), self.posts[:10])
+                self.assertFalse(back.has_previous())
+
+    def test_invalid_cursor(self):
+        """
+        Испорченный курсор открывает первую страницу.
+        """
+        response = self.client.get(self.URLS[0], {'after': 'broken!'})
+        self.assertEqual(
+            list(response.context['page']),
+            self.posts[:10],
+            msg='Неверный курсор не сбрасывается на первую страницу'
+        )
+
+
+class FollowFeedTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.client = Client()
+        self.client.force_login(self.reader)
+        self.old_post = Post.objects.create(
+            text="Old post",
+            author=self.author,
+        )
+        self.FOLLOW = reverse('follow_index')
+
+    def feed_posts(self):
+        return list(self.client.get(self.FOLLOW).context['page'])
+
+    def test_feed_filled_on_follow_and_post(self):
+        """
+        При подписке лента заполняется старыми записями автора,
+        новые записи попадают в неё при публикации,
+        а после отписки записи автора из ленты удаляются.
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.assertEqual(self.feed_posts(), [self.old_post])
+
+        new_post = Post.objects.create(text="New post", author=self.author)
+        self.assertTrue(
+            FeedItem.objects.filter(user=self.reader, post=new_post).exists(),
+            'Новая запись не попала в ленту подписчика'
+        )
+        self.assertEqual(self.feed_posts(), [new_post, self.old_post])
+
+        Follow.objects.filter(user=self.reader, author=self.author).delete()
+        self.assertEqual(self.feed_posts(), [])
+        self.assertFalse(FeedItem.objects.filter(user=self.reader).exists())
+
+    @override_settings(FEED_MAX_SIZE=3, FEED_TRIM_EVERY=1)
+    def test_feed_size_limit(self):
+        """
+        Лента не растёт больше FEED_MAX_SIZE записей.
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(5):
+            Post.objects.create(text=f"Post {i}", author=self.author)
+        self.assertEqual(
+            FeedItem.objects.filter(user=self.reader).count(), 3,
+            'Лента не подрезается до FEED_MAX_SIZE'
+        )
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=0)
+    def test_popular_author_read_live(self):
+        """
+        Записи популярных авторов не раскладываются по лентам,
+        но видны в ленте подписок.
+        """
+        cache.clear()
+        Follow.objects.create(user=self.reader, author=self.author)
+        new_post = Post.objects.create(text="New post", author=self.author)
+        self.assertFalse(FeedItem.objects.filter(post=new_post).exists())
+        self.assertEqual(self.feed_posts(), [new_post, self.old_post])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_popular_authors_from_stats(self):
+        """
+        Популярные авторы определяются по счётчику подписчиков
+        одним запросом, без подсчёта таблицы подписок.
+        """
+        Follow.objects.create(user=self.reader, author=self.author)
+        UserStats.objects.filter(user=self.author).update(followers_count=2)
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(feed.popular_author_ids(), {self.author.pk})
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('posts_follow', queries[0]['sql'])
+
+
+class FeedCountTest(TransactionTestCase):
+    # Числа записей лент сдвигаются после коммита, а TestCase
+    # не фиксирует транзакции.
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Counted")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        self.other = Group.objects.create(
+            title='other',
+            slug='other_slug',
+            description='description')
+
+    def page_count(self, url):
+        return self.client.get(url).context['paginator'].count
+
+    def test_counts_follow_posts(self):
+        """
+        Числа записей лент считаются один раз и дальше сдвигаются
+        при создании, переносе и удалении записей.
+        """
+        index = reverse('index')
+        group = reverse('group', args=[self.group.slug])
+        other = reverse('group', args=[self.other.slug])
+        Post.objects.create(text="Post", author=self.user, group=self.group)
+        self.assertEqual((self.page_count(index), self.page_count(group),
+                          self.page_count(other)), (1, 1, 0))
+        post = Post.objects.create(text="Post 2", author=self.user,
+                                   group=self.group)
+        self.assertEqual((self.page_count(index), self.page_count(group)),
+                         (2, 2))
+        post.group = self.other
+        post.save()
+        self.assertEqual((self.page_count(group), self.page_count(other)),
+                         (1, 1))
+        post.delete()
+        self.assertEqual((self.page_count(index), self.page_count(other)),
+                         (1, 0))
+
+    def test_drifted_count(self):
+        """
+        Откаченная запись не сдвигает число записей, а завышенное
+        число не роняет страницу за концом ленты.
+        """
+        Post.objects.create(text="Post", author=self.user)
+        self.assertEqual(self.page_count(reverse('index')), 1)
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                Post.objects.create(text="Rolled back", author=self.user)
+                raise ValueError
+        self.assertEqual(self.page_count(reverse('index')), 1)
+        cache.set('feed_count:index', 100)
+        response = self.client.get(reverse('index'), {'page': 5})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page']), 1)
+
+    def test_no_count_query(self):
+        """
+        Страница ленты с уже посчитанным числом записей не выполняет
+        COUNT(*).
+        """
+        Post.objects.create(text="Post", author=self.user, group=self.group)
+        for url in (reverse('index'),
+                    reverse('group', args=[self.group.slug])):
+            with self.subTest(url=url):
+                self.client.get(url)
+                Post.objects.create(text="New", author=self.user,
+                                    group=self.group)
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(url)
+                self.assertFalse(
+                    [q for q in queries if 'COUNT(' in q['sql']],
+                    msg='Пагинация пересчитывает записи ленты')
+                self.assertEqual(response.context['paginator'].count,
+                                 Post.objects.count())
+
+    def test_page_window(self):
+        """
+        Навигация показывает первую, последнюю и соседние страницы.
+        """
+        paginator = Paginator(range(1000), 10)
+        self.assertEqual(page_window(paginator.page(1)), [1, 2, 3, None, 100])
+        self.assertEqual(page_window(paginator.page(50)),
+                         [1, None, 48, 49, 50, 51, 52, None, 100])
+        self.assertEqual(page_window(paginator.page(4)),
+                         [1, 2, 3, 4, 5, 6, None, 100])
+        self.assertEqual(page_window(Paginator(range(5), 10).page(1)), [1])
+
+    def test_long_feed_navigation(self):
+        """
+        Длинная лента выводит несколько ссылок на страницы, а не все.
+        """
+        Post.objects.bulk_create(
+            Post(text=f"Post {i}", author=self.user) for i in range(300))
+        response = self.client.get(reverse('index'), {'page': 15})
+        links = re.findall(r'page=(\d+)"', response.content.decode())
+        self.assertEqual(sorted(set(map(int, links))),
+                         [1, 13, 14, 15, 16, 17, 30])
+
+    def test_far_pages_from_near_end(self):
+        """
+        Страницы второй половины ленты читаются с её старого конца
+        без большого OFFSET и совпадают с постраничной нарезкой.
+        """
+        Post.objects.bulk_create(
+            Post(text=f"Post {i}", author=self.user) for i in range(95))
+        posts = list(Post.objects.order_by('-pub_date', '-pk'))
+        for number, expected in ((10, posts[90:]), (7, posts[60:70]),
+                                 (3, posts[20:30])):
+            with self.subTest(page=number):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('index'),
+                                               {'page': number})
+                self.assertEqual(list(response.context['page']), expected)
+                offsets = [int(offset) for offset in re.findall(
+                    r'OFFSET (\d+)', ' '.join(q['sql'] for q in queries))]
+                self.assertLessEqual(max(offsets, default=0), 30)
+
+
+class CountersTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="Counted")
+        self.user2 = User.objects.create_user(username="Counted2")
+        self.post = Post.objects.create(text="Post", author=self.user)
+
+    def assertCounters(self, comments, posts, followers, following):
+        self.post.refresh_from_db()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual(
+            (self.post.comments_count, stats.posts_count,
+             stats.followers_count, stats.following_count),
+            (comments, posts, followers, following),
+            msg='Счётчики не совпадают с данными'
+        )
+
+    def test_counters_follow_changes(self):
+        """
+        Счётчики меняются вместе с записями, комментариями и подписками.
+        """
+        self.assertCounters(0, 1, 0, 0)
+        comment = Comment.objects.create(
+            post=self.post, author=self.user2, text="Comment")
+        Follow.objects.create(user=self.user2, author=self.user)
+        Follow.objects.create(user=self.user, author=self.user2)
+        self.assertCounters(1, 1, 1, 1)
+        comment.delete()
+        Follow.objects.filter(user=self.user2).delete()
+        Post.objects.create(text="Post 2", author=self.user)
+        self.assertCounters(0, 2, 0, 1)
+
+    def test_drifted_counters_stay_positive(self):
+        """
+        Счётчики, отставшие от данных, при удалении не уходят ниже нуля.
+        """
+        Comment.objects.bulk_create(
+            Comment(post=self.post, author=self.user2, text=f"Comment {i}")
+            for i in range(2))
+        UserStats.objects.filter(user=self.user).update(posts_count=0)
+        Comment.objects.first().delete()
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comments_count, 0)
+        self.post.delete()
+        stats = UserStats.objects.get(user=self.user)
+        self.assertEqual(stats.posts_count, 0)
+
+    def test_post_delete_with_comments(self):
+        """
+        Удаление записи не пересчитывает её кэш и счётчик
+        на каждый удаляемый вместе с ней комментарий.
+        """
+        for i in range(30):
+            Comment.objects.create(post=self.post, author=self.user2,
+                                   text=f"Comment {i}")
+        post = Post.objects.get(pk=self.post.pk)
+        with CaptureQueriesContext(connection) as queries:
+            post.delete()
+        self.assertLess(len(queries), 20)
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(UserStats.objects.get(user=self.user).posts_count, 0)
+
+    def test_rebuild_counters(self):
+        """
+        Команда rebuild_counters восстанавливает испорченные счётчики.
+        """
+        Comment.objects.create(
+            post=self.post, author=self.user2, text="Comment")
+        Follow.objects.create(user=self.user2, author=self.user)
+        Post.objects.update(comments_count=10)
+        UserStats.objects.all().delete()
+        call_command('rebuild_counters', batch_size=1, stdout=StringIO())
+        self.assertCounters(1, 1, 1, 0)
+        self.assertEqual(UserStats.objects.count(), 2)
+
+    def test_profile_shows_counters(self):
+        """
+        Профиль выводит сохранённые счётчики.
+        """
+        Follow.objects.create(user=self.user2, author=self.user)
+        response = Client().get(reverse('profile', args=[self.user.username]))
+        self.assertContains(response, 'Подписчиков: 1')
+        self.assertContains(response, 'Записей: 1')
+
+
+class FeedQueriesTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Reader")
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        self.URLS = {
+            reverse('index'): 6,
+            reverse('group', args=[self.group.slug]): 7,
+            reverse('profile', args=[self.user.username]): 7,
+            reverse('follow_index'): 7,
+        }
+
+    def add_posts(self, count):
+        for i in range(Post.objects.count(), Post.objects.count() + count):
+            author = User.objects.create_user(username=f"Author{i}")
+            Follow.objects.create(user=self.user, author=author)
+            Post.objects.create(text=f"Post {i}", author=author,
+                                group=self.group)
+            Post.objects.create(text=f"Own post {i}", author=self.user,
+                                group=self.group)
+
+    def test_feed_queries_do_not_grow(self):
+        """
+        Число запросов на страницу ленты не зависит от числа карточек.
+        """
+        for count in (1, 9):
+            self.add_posts(count)
+            for url, queries in self.URLS.items():
+                with self.subTest(url=url, posts=count):
+                    cache.clear()
+                    with self.assertNumQueries(queries):
+                        self.client.get(url)
+
+
+class GroupListTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Grouped")
+        self.url = reverse('group_list')
+
+    def add_groups(self, count):
+        for i in range(Group.objects.count(), Group.objects.count() + count):
+            group = Group.objects.create(title=f'group {i}',
+                                         slug=f'group_{i}',
+                                         description='description')
+            for j in range(3):
+                Post.objects.create(text=f"Post {i}.{j}", author=self.user,
+                                    group=group)
+
+    def test_group_list(self):
+        """
+        Каталог выводит сообщества с числом записей и последней записью.
+        """
+        self.add_groups(2)
+        empty = Group.objects.create(title='empty', slug='empty',
+                                     description='description')
+        response = self.client.get(self.url)
+        groups = {group.slug: group for group in response.context['groups']}
+        latest = Post.objects.filter(group__slug='group_1').first()
+        self.assertEqual(
+            (groups['group_1'].posts_count, groups['group_1'].last_post_id,
+             groups['group_1'].last_post_author),
+            (3, latest.pk, self.user.username))
+        self.assertEqual(groups['group_1'].last_pub_date, latest.pub_date)
+        self.assertEqual((groups[empty.slug].posts_count,
+                          groups[empty.slug].last_post_id), (0, None))
+        self.assertContains(response, 'Post 1.2')
+        self.assertContains(response, reverse('group', args=[empty.slug]))
+
+    def test_queries_do_not_grow(self):
+        """
+        Каталог строится одним запросом при любом числе сообществ.
+        """
+        for count in (1, 10):
+            self.add_groups(count)
+            cache.clear()
+            with self.subTest(groups=count):
+                # Запрос каталога и точка сохранения ATOMIC_REQUESTS
+                with self.assertNumQueries(3):
+                    self.client.get(self.url)
+
+    def test_cache_follows_posts(self):
+        """
+        Каталог берётся из кэша, пока записи и сообщества не меняются.
+        """
+        self.add_groups(1)
+        self.client.get(self.url)
+        self.assertEqual(self.client.get(self.url).query_stats.count, 0,
+                         msg='Каталог из кэша не должен ходить в базу')
+        group = Group.objects.get()
+        post = Post.objects.create(text="Newest", author=self.user,
+                                   group=group)
+        self.assertContains(self.client.get(self.url), 'Newest')
+        post.group = None
+        post.save()
+        response = self.client.get(self.url)
+        self.assertNotContains(response, 'Newest')
+        self.assertEqual(response.context['groups'][0].posts_count, 3)
+        Group.objects.create(title='new group', slug='new_group',
+                             description='description')
+        self.assertContains(self.client.get(self.url), 'new group')
+
+
+class PostCardCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="Author")
+        self.reader = User.objects.create_user(username="Reader")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        self.post = Post.objects.create(
+            text="Cached text",
+            author=self.author,
+            group=self.group,
+        )
+        self.author_client = Client()
+        self.author_client.force_login(self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+        self.PROFILE = reverse('profile', args=[self.author.username])
+
+    def test_card_shared_between_viewers(self):
+        """
+        Карточка кэшируется одна на всех, а кнопка «Редактировать»
+        видна только автору.
+        """
+        self.assertContains(self.author_client.get(self.PROFILE),
+                            'Редактировать')
+        Post.objects.filter(pk=self.post.pk).update(text="Not yet visible")
+        response = self.reader_client.get(self.PROFILE)
+        self.assertContains(response, 'Cached text')
+        self.assertNotContains(response, 'Редактировать')
+
+    def test_card_version_bumped(self):
+        """
+        Правка записи, комментарий и переименование сообщества
+        сбрасывают закэшированную карточку.
+        """
+        self.reader_client.get(self.PROFILE)
+        self.post.text = "Edited text"
+        self.post.save()
+        self.assertContains(self.reader_client.get(self.PROFILE),
+                            'Edited text')
+
+        version = self.post.card_version
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Comment")
+        self.assertNotEqual(self.post.card_version, version)
+
+        self.group.title = "Renamed group"
+        self.group.save()
+        self.assertContains(self.reader_client.get(self.PROFILE),
+                            '#Renamed group')
+
+
+class StampedeCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        time.sleep(0.2)
+        return self.calls
+
+    def test_single_flight(self):
+        """
+        Одновременные промахи пересчитывают ключ только один раз.
+        """
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(
+                get_or_compute('hot', self.compute, 60)))
+            for _ in range(5)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1, 'Ключ пересчитан несколько раз')
+        self.assertEqual(results, [1] * 5)
+
+    def test_stale_while_recomputing(self):
+        """
+        Пока ключ пересчитывает другой запрос, отдаётся старое значение;
+        новая версия пересчитывается.
+        """
+        get_or_compute('hot', lambda: 'old', 60, version=1)
+        cache.add(LOCK_KEY.format('hot'), 1)
+        self.assertEqual(
+            get_or_compute('hot', lambda: 'new', 60, version=2), 'old')
+        cache.delete(LOCK_KEY.format('hot'))
+        self.assertEqual(
+            get_or_compute('hot', lambda: 'new', 60, version=2), 'new')
+
+
+class SharedCacheTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        # Тот же каталог кэша глазами другого процесса, например run_worker
+        self.other = SharedFileCache(settings.CACHES['default']['LOCATION'],
+                                     {})
+
+    def test_versions_shared_between_processes(self):
+        """
+        Версию, сдвинутую другим процессом, видит и этот:
+        миниатюра из run_worker сбрасывает карточку на сайте.
+        """
+        before = get_versions('post:1')
+        self.other.incr(VERSION_KEY.format('post:1'))
+        self.assertNotEqual(get_versions('post:1'), before)
+
+    def test_atomic_add_and_incr(self):
+        """
+        add не перезаписывает чужую запись, incr не теряет сдвиги
+        из параллельных потоков и сохраняет срок записи.
+        """
+        self.assertTrue(cache.add('lock', 1, 60))
+        self.assertFalse(self.other.add('lock', 2, 60))
+        cache.set('counter', 0, 60)
+        threads = [threading.Thread(target=lambda: [
+            self.other.incr('counter') for _ in range(20)])
+            for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(cache.get('counter'), 100)
+        with self.assertRaises(ValueError):
+            cache.incr('missing')
+
+
+class SearchTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="Searcher")
+        self.client = Client()
+        self.by_text = Post.objects.create(
+            text="Рецепт пирога с яблоками", author=self.user)
+        self.by_comment = Post.objects.create(
+            text="Что приготовить на ужин?", author=self.user)
+        Comment.objects.create(post=self.by_comment, author=self.user,
+                               text="Испеки пирога кусок")
+        Post.objects.create(text="Совсем другая запись", author=self.user)
+        self.SEARCH = reverse('search')
+
+    def found(self, query):
+        response = self.client.get(self.SEARCH, {'q': query})
+        return list(response.context['page'])
+
+    def test_search_posts_and_comments(self):
+        """
+        Поиск находит записи по тексту и по комментариям,
+        совпадение в тексте записи выше.
+        """
+        self.assertEqual(self.found('пирога'),
+                         [self.by_text, self.by_comment])
+        self.assertEqual(self.found('яблоками пирога'), [self.by_text])
+        self.assertEqual(self.found('"OR'), [])
+
+    def test_search_index_follows_changes(self):
+        """
+        Индекс поиска обновляется при правке и удалении записи.
+        """
+        self.by_text.text = "Рецепт торта"
+        self.by_text.save()
+        self.assertEqual(self.found('торта'), [self.by_text])
+        self.assertEqual(self.found('яблоками'), [])
+        self.by_comment.delete()
+        self.assertEqual(self.found('пирога'), [])
+
+    def test_admin_search(self):
+        """
+        Поиск в админке идёт по тому же индексу.
+        """
+        admin = User.objects.create_superuser(
+            username="admin", email="admin@a.a", password="qwe")
+        self.client.force_login(admin)
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'яблоками'})
+        self.assertEqual(
+            list(response.context['cl'].result_list), [self.by_text])
+
+
+class ThumbnailTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="Photographer")
+        self.post = Post.objects.create(
+            text="post with image",
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='test.gif',
+                content=(
+                    b'\x47\x49\x46\x38\x39\x61\x01\x00\x01\x00\x00\x00'
+                    b'\x00\x21\xf9\x04\x01\x0a\x00\x01\x00\x2c\x00\x00'
+                    b'\x00\x00\x01\x00\x01\x00\x00\x02\x02\x4c\x01\x00'
+                    b'\x3b'),
+                content_type='image/gif',
+            ),
+        )
+        self.PROFILE = reverse('profile', args=[self.user.username])
+
+    def test_render_does_not_create_thumbnail(self):
+        """
+        Пока миниатюры нет, карточка показывает исходную картинку,
+        а рендер её не создаёт.
+        """
+        response = Client().get(self.PROFILE)
+        self.assertContains(response, self.post.image.url)
+        self.assertIsNone(thumbnails.lookup(self.post.image, 'card'))
+
+    def test_generated_thumbnail_used(self):
+        """
+        После фоновой задачи карточка берёт готовую миниатюру.
+        """
+        Client().get(self.PROFILE)
+        self.assertEqual(jobs.run_pending(), 1)
+        thumbnail = thumbnails.lookup(self.post.image, 'card')
+        self.assertIsNotNone(thumbnail, 'Миниатюра не создана')
+        self.assertContains(Client().get(self.PROFILE), thumbnail.url)
+
+
+class UploadLimitsTest(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="Uploader")
+        self.client = Client()
+        self.client.force_login(self.user)
+        self.POST_NEW = reverse('post_new')
+
+    def create_png(self, size):
+        file = BytesIO()
+        Image.new('RGB', size).save(file, 'png')
+        return SimpleUploadedFile(
+            name='big.png',
+            content=file.getvalue(),
+            content_type='image/png',
+        )
+
+    def post_image(self, image):
+        return self.client.post(
+            self.POST_NEW,
+            {
+                'text': 'post with image',
+                'image': image,
+            }
+        )
+
+    @override_settings(POSTS_UPLOAD_MAX_SIZE=100)
+    def test_file_too_large(self):
+        """
+        Файл больше POSTS_UPLOAD_MAX_SIZE отклоняется с понятной ошибкой.
+        """
+        response = self.post_image(self.create_png((200, 200)))
+        self.assertFormError(
+            response,
+            'form',
+            'image',
+            'Файл слишком большой, максимальный размер — 100\xa0байт.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POSTS_IMAGE_MAX_PIXELS=100)
+    def test_too_many_pixels(self):
+        """
+        Картинка с размерами больше лимита отклоняется
+        по заголовку, до декодирования.
+        """
+        response = self.post_image(self.create_png((20, 20)))
+        self.assertFormError(
+            response,
+            'form',
+            'image',
+            'Картинка 20×20 слишком большая, допустимо не больше 100 пикселей.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    def test_image_within_limits(self):
+        """
+        Обычная картинка сохраняется.
+        """
+        response = self.post_image(self.create_png((20, 20)))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Post.objects.filter(image__endswith='.png').exists())
+
+
+@override_settings(POSTS_COMMENTS_PER_PAGE=3)
+class CommentPaginationTest(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.author = User.objects.create_user(username="Author")
+        self.post = Post.objects.create(text="Post", author=self.author)
+        for i in range(5):
+            commenter = User.objects.create_user(username=f"Commenter{i}")
+            Comment.objects.create(post=self.post, author=commenter,
+                                   text=f"Comment {i}")
+
+    def test_comments_loaded_in_batches(self):
+        """
+        На странице записи только первая пачка комментариев,
+        остальные догружаются по курсору.
+        """
+        response = self.client.get(
+            reverse('post_detail', args=[self.author.username, self.post.pk]))
+        comments = response.context['comments']
+        self.assertEqual([c.text for c in comments],
+                         ['Comment 4', 'Comment 3', 'Comment 2'])
+        more_url = reverse('post_comments',
+                           args=[self.author.username, self.post.pk])
+        self.assertContains(response, more_url)
+        # Запись с автором и пачка комментариев, плюс точки сохранения
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                more_url, {'after': response.context['next_cursor']})
+        self.assertEqual([c.text for c in response.context['comments']],
+                         ['Comment 1', 'Comment 0'])
+        self.assertNotContains(response, 'Показать ещё комментарии')
+        self.assertContains(response, '@Commenter0')
+
+
+class QueryPlanTest(TestCase):
+    # Полный проход по таблице без индекса: «SCAN posts_post»
+    FULL_SCAN = re.compile(r'^SCAN \S+$')
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        Follow.objects.create(user=self.reader, author=self.author)
+        for i in range(3):
+            self.post = Post.objects.create(text=f"Post {i}",
+                                            author=self.author,
+                                            group=self.group)
+            Comment.objects.create(post=self.post, author=self.reader,
+                                   text=f"Comment {i}")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def assert_plans_use_indexes(self, url, data=None):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            if not query['sql'].startswith('SELECT'):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                details = [row[-1] for row in cursor.fetchall()]
+            for detail in details:
+                with self.subTest(url=url, data=data, sql=query['sql']):
+                    self.assertIsNone(self.FULL_SCAN.match(detail), details)
+                    self.assertNotIn('USE TEMP B-TREE', detail, details)
+
+    def test_views_use_indexes(self):
+        """
+        Запросы страниц ходят по индексам: без полного прохода
+        по таблице и без сортировки во временном B-дереве.
+        """
+        after = encode_cursor(self.post.pub_date, self.post.pk)
+        for url in (reverse('index'),
+                    reverse('group', args=[self.group.slug]),
+                    reverse('profile', args=[self.author.username]),
+                    reverse('follow_index')):
+            self.assert_plans_use_indexes(url)
+            self.assert_plans_use_indexes(url, {'after': after})
+        self.assert_plans_use_indexes(
+            reverse('post_detail', args=[self.author.username, self.post.pk]))
+        comment = self.post.comments.get()
+        self.assert_plans_use_indexes(
+            reverse('post_comments', args=[self.author.username, self.post.pk]),
+            {'after': encode_cursor(comment.created, comment.pk)})
+
+
+class FollowWriteTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="Reader")
+        self.authors = [User.objects.create_user(username=f"Author{i}")
+                        for i in range(3)]
+        self.post = Post.objects.create(text="Post", author=self.authors[0])
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_follow_and_unfollow_idempotent(self):
+        """
+        Повторная подписка и отписка ничего не ломают,
+        а счётчики и лента меняются ровно один раз.
+        """
+        author = self.authors[0]
+        for _ in range(2):
+            self.client.get(reverse('profile_follow', args=[author.username]))
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 1)
+        self.assertEqual(author.stats.followers_count, 1)
+        self.assertTrue(FeedItem.objects.filter(user=self.reader,
+                                                post=self.post).exists())
+        for _ in range(2):
+            self.client.get(
+                reverse('profile_unfollow', args=[author.username]))
+        self.assertFalse(Follow.objects.exists())
+        author.stats.refresh_from_db()
+        self.assertEqual(author.stats.followers_count, 0)
+        self.assertFalse(FeedItem.objects.exists())
+        self.client.get(
+            reverse('profile_follow', args=[self.reader.username]))
+        self.assertFalse(Follow.objects.exists())
+
+    def test_bulk_follow(self):
+        """
+        Пакетная подписка и отписка по списку имён.
+        """
+        Follow.objects.create(user=self.reader, author=self.authors[0])
+        url = reverse('follow_bulk')
+        response = self.client.post(url, {
+            'username': [author.username for author in self.authors]
+                        + ['Nobody'],
+        })
+        self.assertEqual(response.json(), {
+            'action': 'follow',
+            'changed': ['Author1', 'Author2'],
+            'missing': ['Nobody'],
+        })
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 3)
+        self.assertEqual(self.reader.stats.following_count, 3)
+        response = self.client.post(url, {
+            'action': 'unfollow',
+            'username': ['Author0', 'Author2'],
+        })
+        self.assertEqual(response.json()['changed'], ['Author0', 'Author2'])
+        self.assertEqual(
+            list(Follow.objects.values_list('author__username', flat=True)),
+            ['Author1'])
+        self.assertEqual(self.client.get(url).status_code, 405)
+        with override_settings(POSTS_FOLLOW_BULK_MAX=2):
+            response = self.client.post(url, {
+                'username': [author.username for author in self.authors]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Follow.objects.filter(user=self.reader).count(), 1)
+
+
+class ApiTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="Reader")
+        self.author = User.objects.create_user(username="Author")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        Follow.objects.create(user=self.reader, author=self.author)
+        self.posts = [Post.objects.create(text=f"Post {i}",
+                                          author=self.author,
+                                          group=self.group)
+                      for i in range(3)]
+        Comment.objects.create(post=self.posts[0], author=self.reader,
+                               text="Comment")
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_feeds_paginate_by_cursor(self):
+        """
+        Ленты API отдают записи страницами по курсору.
+        """
+        for url in (reverse('api_index'),
+                    reverse('api_group', args=[self.group.slug]),
+                    reverse('api_profile', args=[self.author.username]),
+                    reverse('api_follow_index')):
+            with self.subTest(url=url):
+                data = self.client.get(url, {'limit': 2}).json()
+                self.assertEqual([post['text'] for post in data['results']],
+                                 ['Post 2', 'Post 1'])
+                data = self.client.get(
+                    url, {'limit': 2, 'after': data['next']}).json()
+                self.assertEqual([post['text'] for post in data['results']],
+                                 ['Post 0'])
+                self.assertIsNone(data['next'])
+
+    def test_sparse_fields_and_since(self):
+        """
+        `fields` ограничивает поля, `since` отдаёт только новые записи.
+        """
+        url = reverse('api_index')
+        data = self.client.get(url, {'fields': 'id,author'}).json()
+        self.assertEqual(data['results'][0],
+                         {'id': self.posts[2].pk, 'author': 'Author'})
+        since = self.client.get(url).json()['results'][1]['pub_date']
+        data = self.client.get(url, {'since': since}).json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         ['Post 2'])
+        self.assertEqual(
+            self.client.get(url, {'fields': 'password'}).status_code, 400)
+        self.assertEqual(
+            self.client.get(url, {'after': 'broken'}).status_code, 400)
+        for since in ('вчера', '2020-13-45T00:00:00'):
+            with self.subTest(since=since):
+                self.assertEqual(
+                    self.client.get(url, {'since': since}).status_code, 400)
+
+    def test_naive_since(self):
+        """
+        `since` без смещения считается датой в часовом поясе сайта.
+        """
+        url = reverse('api_index')
+        since = timezone.localtime(self.posts[1].pub_date).replace(
+            tzinfo=None)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error', RuntimeWarning)
+            data = self.client.get(url, {'since': since.isoformat()}).json()
+        self.assertEqual([post['text'] for post in data['results']],
+                         ['Post 2'])
+
+    def test_post_detail(self):
+        """
+        Запись отдаётся вместе с комментариями.
+        """
+        post = self.posts[0]
+        data = self.client.get(reverse('api_post', args=[post.pk])).json()
+        self.assertEqual(data['post']['group'], 'group_slug')
+        self.assertEqual(data['post']['comments_count'], 1)
+        self.assertEqual(data['comments'][0]['author'], 'Reader')
+        self.assertEqual(
+            self.client.get(reverse('api_post', args=[0])).status_code, 404)
+        self.assertEqual(
+            Client().get(reverse('api_follow_index')).status_code, 401)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="Author")
+        self.reader = User.objects.create_user(username="Reader")
+        self.group = Group.objects.create(
+            title='group',
+            slug='group_slug',
+            description='description')
+        self.post = Post.objects.create(text="Post", author=self.author,
+                                        group=self.group)
+        self.urls = (
+            reverse('profile', args=[self.author.username]),
+            reverse('group', args=[self.group.slug]),
+            reverse('post_detail', args=[self.author.username, self.post.pk]),
+        )
+
+    def test_not_modified(self):
+        """
+        Неизменившаяся страница отвечает 304 без запросов к базе,
+        после изменения — снова 200.
+        """
+        client = Client()
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = client.get(url)
+                etag = response['ETag']
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                # Остаются только точки сохранения ATOMIC_REQUESTS
+                self.assertFalse([query for query in queries.captured_queries
+                                  if 'SAVEPOINT' not in query['sql']])
+                response = client.get(
+                    url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+                self.assertEqual(response.status_code, 304)
+        Comment.objects.create(post=self.post, author=self.reader,
+                               text="Comment")
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_user(self):
+        """
+        Разные пользователи получают разные ETag одной страницы.
+        """
+        reader = Client()
+        reader.force_login(self.reader)
+        for url in self.urls:
+            with self.subTest(url=url):
+                etag = Client().get(url)['ETag']
+                response = reader.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotEqual(response['ETag'], etag)
+                self.assertFalse(response.has_header('Last-Modified'))
+
+
+class GenerateDataTest(TestCase):
+
+    def test_generate_and_benchmark(self):
+        """
+        generate_data заполняет базу вместе со счётчиками и лентами,
+        benchmark замеряет по ней адреса и сохраняет JSON.
+        """
+        call_command('generate_data', users=10, groups=2, posts=50,
+                     comments=40, follows=3, images=0.5, seed=1,
+                     stdout=StringIO())
+        self.assertEqual(User.objects.count(), 10)
+        self.assertEqual(Post.objects.count(), 50)
+        self.assertEqual(Comment.objects.count(), 40)
+        self.assertTrue(Post.objects.exclude(image='').exists())
+        stats = UserStats.objects.get(user=Post.objects.first().author)
+        self.assertEqual(stats.posts_count,
+                         Post.objects.filter(author=stats.user).count())
+        follow = Follow.objects.first()
+        self.assertEqual(
+            FeedItem.objects.filter(user=follow.user_id).count(),
+            Post.objects.filter(author__following__user=follow.user_id)
+            .count())
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'benchmark.json')
+            call_command('benchmark', runs=2, output=output,
+                         stdout=StringIO())
+            with open(output) as file:
+                report = json.load(file)
+        self.assertEqual(report['rows']['post'], 50)
+        self.assertEqual(report['results']['index']['status'], 200)
+        self.assertNotIn('comment_delete', report['results'])
+        self.assertLessEqual(report['results']['profile']['p50_ms'],
+                             report['results']['profile']['p99_ms'])
+
+
+class QueryBudgetTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="Author")
+        Post.objects.create(text="Post", author=self.author)
+
+    def test_stats_on_response(self):
+        """
+        Статистика запросов доступна в ответе тестового клиента.
+        """
+        response = self.client.get(reverse('index'))
+        stats = response.query_stats
+        self.assertEqual(stats.url_name, 'index')
+        self.assertGreater(stats.count, 0)
+        self.assertEqual(stats.duplicates, 0)
+        self.assertEqual(self.client.get(reverse('index')).query_stats.count,
+                         0, msg='Страница из кэша не должна ходить в базу')
+
+    @override_settings(POSTS_QUERY_BUDGETS={'index': {'queries': 1}})
+    def test_budget_exceeded(self):
+        """
+        Превышение бюджета в тестах — ошибка, в работе — предупреждение.
+        """
+        with self.assertRaisesMessage(QueryBudgetExceeded, 'queries'):
+            self.client.get(reverse('index'))
+        cache.clear()
+        with override_settings(POSTS_QUERY_BUDGET_STRICT=False):
+            with self.assertLogs('posts.middleware', 'WARNING'):
+                response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_logged_in_budgets(self):
+        """
+        У вошедшего пользователя каждая страница из бюджетов укладывается
+        в него с запасом хотя бы в один запрос.
+        """
+        reader = User.objects.create_user(username='reader')
+        group = Group.objects.create(title='Группа', slug='group')
+        post = Post.objects.create(text='Post', author=self.author,
+                                   group=group)
+        Comment.objects.create(post=post, author=reader, text='Комментарий')
+        Follow.objects.create(user=reader, author=self.author)
+        urls = {
+            'index': reverse('index'),
+            'group': reverse('group', args=[group.slug]),
+            'group_list': reverse('group_list'),
+            'profile': reverse('profile', args=['Author']),
+            'follow_index': reverse('follow_index'),
+            'post_detail': reverse('post_detail', args=['Author', post.pk]),
+            'post_comments': reverse('post_comments',
+                                     args=['Author', post.pk]),
+            'search': reverse('search') + '?q=Post',
+            'api_index': reverse('api_index'),
+            'api_post': reverse('api_post', args=[post.pk]),
+            'api_group': reverse('api_group', args=[group.slug]),
+            'api_profile': reverse('api_profile', args=['Author']),
+            'api_follow_index': reverse('api_follow_index'),
+        }
+        self.assertEqual(set(urls), set(settings.POSTS_QUERY_BUDGETS))
+        self.client.force_login(reader)
+        for name, url in urls.items():
+            with self.subTest(name):
+                cache.clear()
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLess(response.query_stats.count,
+                                settings.POSTS_QUERY_BUDGETS[name]['queries'])
+
+    def test_duplicates(self):
+        """
+        Повторы запросов и запросы N+1 видны в статистике.
+        """
+        with QueryStats().record() as stats:
+            for _ in range(2):
+                list(User.objects.filter(pk=self.author.pk))
+            list(User.objects.filter(pk=0))
+        self.assertEqual(stats.count, 3)
+        self.assertEqual(stats.duplicates, 1)
+        self.assertEqual(list(stats.similar().values()), [3])
+
+
+class ProfilerTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.settings = override_settings(POSTS_PROFILE_DIR=self.directory.name,
+                                          POSTS_PROFILE_KEEP=2)
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def profiles(self):
+        return sorted(os.listdir(self.directory.name))
+
+    def test_signed_header(self):
+        """
+        Без выборки профилируются только запросы с подписанным заголовком.
+        """
+        self.client.get(reverse('index'), HTTP_X_PROFILE='forged')
+        self.assertEqual(self.profiles(), [])
+        out = StringIO()
+        call_command('profile_report', token=True, stdout=out)
+        token = out.getvalue().split(': ')[1].strip()
+        self.client.get(reverse('index'), HTTP_X_PROFILE=token)
+        self.assertEqual(len(self.profiles()), 1)
+        self.assertRegex(self.profiles()[0], r'^\d+-\d+ms-index\.prof$')
+
+    @override_settings(POSTS_PROFILE_SAMPLE_RATE=1)
+    def test_sampling_rotation_and_report(self):
+        """
+        Профили ротируются, отчёт группирует их по вью.
+        """
+        for url in (reverse('index'), reverse('index'), reverse('search')):
+            self.client.get(url)
+        self.assertEqual(len(self.profiles()), 2)
+        out = StringIO()
+        call_command('profile_report', top=5, stdout=out)
+        report = out.getvalue()
+        self.assertIn('index: 1 запросов', report)
+        self.assertIn('search: 1 запросов', report)
+        self.assertIn('function calls', report)
+
+
+class SqlitePragmasTest(TestCase):
+
+    def test_connection_pragmas(self):
+        """
+        Новое соединение получает PRAGMA из настроек.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1, msg='Ожидался NORMAL')
+
+    def test_concurrency_benchmark(self):
+        """
+        Замер чтений и записей выполняется для обоих режимов.
+        """
+        out = StringIO()
+        call_command('sqlite_concurrency', readers=2, writers=1,
+                     seconds=0.2, json=True, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results), {'default', 'tuned'})
+        for result in results.values():
+            self.assertGreater(result['reads_per_second'], 0)
+            self.assertGreater(result['writes_per_second'], 0)
+
+
+@override_settings(POSTS_REPLICA_READS=True)
+class ReplicaTest(TransactionTestCase):
+    # В тестах реплика — зеркало основной базы через отдельное соединение
+    databases = {'default', REPLICA}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer',
+                                             password='12345')
+        Post.objects.create(text='Старая запись', author=self.user)
+        self.client.force_login(self.user)
+
+    def get_index(self):
+        with CaptureQueriesContext(connections[REPLICA]) as replica, \
+                CaptureQueriesContext(connection) as primary:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.status_code, 200)
+        return len(replica.captured_queries), len(primary.captured_queries)
+
+    def test_router(self):
+        """
+        Внутри reading_replica записи читаются из реплики,
+        пользователи — всегда из основной базы.
+        """
+        with reading_replica():
+            self.assertEqual(Post.objects.all().db, REPLICA)
+            self.assertEqual(User.objects.all().db, 'default')
+        self.assertEqual(Post.objects.all().db, 'default')
+
+    def test_sticky_after_write(self):
+        """
+        Лента читается из реплики, а после своей записи пользователь
+        читает из основной базы и сразу видит новую запись.
+        """
+        replica_queries, _ = self.get_index()
+        self.assertGreater(replica_queries, 0)
+        response = self.client.post(reverse('post_new'),
+                                    {'text': 'Свежая запись'})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn(STICKY_COOKIE, response.cookies)
+        replica_queries, primary_queries = self.get_index()
+        self.assertEqual(replica_queries, 0)
+        self.assertGreater(primary_queries, 0)
+        self.assertContains(self.client.get(reverse('index')),
+                            'Свежая запись')
+
+    def test_replicate(self):
+        """
+        replicate копирует базу и сдвигает версию кэша реплики.
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, 'primary.sqlite3')
+            target = os.path.join(directory, 'replica.sqlite3')
+            with sqlite3.connect(source) as db:
+                db.execute('CREATE TABLE item (name TEXT)')
+                db.execute("INSERT INTO item VALUES ('копия')")
+            db.close()
+            version = get_versions(REPLICA)[0]
+            replicate(source, target)
+            with sqlite3.connect(target) as db:
+                rows = db.execute('SELECT name FROM item').fetchall()
+            db.close()
+        self.assertEqual(rows, [('копия',)])
+        self.assertGreater(get_versions(REPLICA)[0], version)
+
+    def test_requires_shared_cache(self):
+        """
+        Реплика с кэшем в памяти процесса — ошибка проверки: сдвиг версии
+        из replicate_db не дошёл бы до сайта.
+        """
+        local = {'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(POSTS_REPLICA_READS=True, CACHES=local):
+            self.assertEqual([error.id for error in replica_cache_check(None)],
+                             ['posts.E001'])
+        with override_settings(POSTS_REPLICA_READS=True):
+            self.assertEqual(replica_cache_check(None), [])
+
+
+@override_settings(ROOT_URLCONF='yatube.urls_async')
+class AsyncViewsTest(TransactionTestCase):
+    # Асинхронные вью читают из потоков со своими соединениями,
+    # им нужны зафиксированные данные, а не транзакция теста.
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='author',
+                                               password='12345')
+        self.posts = [Post.objects.create(text=f'Запись {i}',
+                                          author=self.author)
+                      for i in range(12)]
+        self.post = self.posts[-1]
+        for i in range(25):
+            Comment.objects.create(post=self.post, author=self.author,
+                                   text=f'Комментарий {i}')
+
+    async def test_profile(self):
+        """
+        Асинхронная страница автора показывает те же записи и страницы.
+        """
+        client = AsyncClient()
+        response = await client.get(
+            reverse('profile', args=[self.author.username]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['paginator'].count, 12)
+        self.assertEqual(list(response.context['page']), self.posts[:-11:-1])
+        self.assertEqual(response.context['author'], self.author)
+        self.assertFalse(response.context['following'])
+        # AsyncClient в Django 3.1 не переносит `data` в строку запроса
+        response = await client.get(
+            reverse('profile', args=[self.author.username]) + '?page=99')
+        self.assertEqual(list(response.context['page']), self.posts[1::-1])
+        response = await client.get(reverse('profile', args=['nobody']))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_post_view(self):
+        """
+        Асинхронная страница записи показывает первую пачку
+        комментариев и курсор следующей.
+        """
+        response = await AsyncClient().get(
+            reverse('post_detail', args=[self.author.username, self.post.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['post'], self.post)
+        self.assertEqual(len(response.context['comments']), 20)
+        self.assertIsNotNone(response.context['next_cursor'])
+        response = await AsyncClient().get(
+            reverse('post_detail', args=['nobody', self.post.pk]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_conditional_get(self):
+        """
+        Асинхронные вью отвечают 304 на совпавший ETag.
+        """
+        client = AsyncClient()
+        url = reverse('profile', args=[self.author.username])
+        etag = (await client.get(url))['ETag']
+        # Заголовки AsyncClient в Django 3.1 передаются как есть
+        response = await client.get(url, **{'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+
+    def test_benchmark(self):
+        """
+        Сравнение WSGI и ASGI замеряет оба режима для каждой страницы.
+        """
+        out = StringIO()
+        call_command('benchmark_asgi', requests=4, concurrency=2, json=True,
+                     stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results), {'profile', 'post_detail'})
+        for modes in results.values():
+            self.assertEqual(set(modes), {'wsgi', 'asgi'})
+            for result in modes.values():
+                self.assertEqual(result['statuses'], [200])
+
+
+# Задачи для тестов очереди: импортируются по пути, как настоящие
+JOB_CALLS = []
+
+
+def record_job(*args):
+    JOB_CALLS.append(args)
+
+
+def failing_job():
+    raise ValueError('Сбой задачи')
+
+
+def atomic_job():
+    JOB_CALLS.append((connection.in_atomic_block,))
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        JOB_CALLS.clear()
+
+    def test_dedup_key(self):
+        """
+        Пока задача ждёт в очереди, такая же не добавляется;
+        взятая в работу задачу с тем же ключом не блокирует.
+        """
+        jobs.enqueue(record_job, 1, dedup_key='same')
+        jobs.enqueue(record_job, 1, dedup_key='same')
+        self.assertEqual(Job.objects.count(), 1)
+        jobs.claim(1)
+        jobs.enqueue(record_job, 1, dedup_key='same')
+        self.assertEqual(Job.objects.filter(state=Job.QUEUED).count(), 1)
+        self.assertEqual(Job.objects.count(), 2)
+
+    def test_success_deletes_job(self):
+        """
+        Выполненная задача получает свои аргументы и удаляется.
+        """
+        jobs.enqueue(record_job, 1, 'два')
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(JOB_CALLS, [(1, 'два')])
+        self.assertFalse(Job.objects.exists())
+
+    def test_retry_with_backoff(self):
+        """
+        Упавшая задача откладывается на растущую паузу,
+        а после последней попытки остаётся с ошибкой.
+        """
+        jobs.enqueue(failing_job, max_attempts=2)
+        self.assertEqual(jobs.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.state, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('Сбой задачи', job.last_error)
+        self.assertEqual(jobs.run_pending(), 0, 'Пауза перед повтором')
+        Job.objects.update(run_at=timezone.now())
+        jobs.run_pending()
+        job = Job.objects.get()
+        self.assertEqual((job.state, job.attempts), (Job.FAILED, 2))
+        self.assertLess(jobs.backoff(1), jobs.backoff(3) * 2)
+
+    def test_visibility_timeout(self):
+        """
+        Взятая задача скрыта от других исполнителей, пока не истечёт
+        время видимости; опоздавший исполнитель её уже не выполнит.
+        """
+        jobs.enqueue(record_job, 1)
+        first = jobs.claim(1)[0]
+        self.assertEqual(jobs.claim(1), [])
+        Job.objects.update(run_at=timezone.now())
+        second = jobs.claim(1)[0]
+        self.assertEqual(second.attempts, 2)
+        jobs.execute(first.pk, first.claim)
+        self.assertEqual(JOB_CALLS, [])
+        jobs.execute(second.pk, second.claim)
+        self.assertEqual(JOB_CALLS, [(1,)])
+
+    def test_lost_worker_attempts(self):
+        """
+        Задача, которую исполнитель взял и не вернул на последней
+        попытке, помечается упавшей, а не берётся снова.
+        """
+        jobs.enqueue(record_job, 1, max_attempts=1)
+        jobs.claim(1)
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(jobs.claim(1), [])
+        self.assertEqual(Job.objects.get().state, Job.FAILED)
+
+    def test_worker_survives_database_error(self):
+        """
+        Ошибка базы при чтении задачи в исполнителе пишется в лог
+        и оставляет задачу взятой до истечения времени видимости.
+        """
+        def locked(execute, sql, params, many, context):
+            if sql.startswith('SELECT') and 'posts_job' in sql:
+                raise OperationalError('database table is locked')
+            return execute(sql, params, many, context)
+
+        jobs.enqueue(record_job, 1)
+        job = jobs.claim(1)[0]
+        with self.assertLogs('posts.jobs', 'ERROR'):
+            with connection.execute_wrapper(locked):
+                jobs.execute_in_worker(job.pk, job.claim)
+        self.assertEqual(Job.objects.get().state, Job.RUNNING)
+        self.assertEqual(JOB_CALLS, [])
+
+    @override_settings(FEED_FANOUT_INLINE_MAX=0)
+    def test_large_fan_out_queued(self):
+        """
+        Запись автора со многими подписчиками раскладывается
+        по лентам фоновой задачей.
+        """
+        author = User.objects.create_user(username='popular')
+        reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=reader, author=author)
+        post = Post.objects.create(text='Запись', author=author)
+        self.assertFalse(FeedItem.objects.filter(post=post).exists())
+        jobs.run_pending()
+        self.assertTrue(FeedItem.objects.filter(user=reader,
+                                                post=post).exists())
+
+    def test_queued_counters_rebuild(self):
+        """
+        rebuild_counters --queue пересчитывает счётчики задачами.
+        """
+        user = User.objects.create_user(username='counted')
+        post = Post.objects.create(text='Запись', author=user)
+        Post.objects.update(comments_count=5)
+        UserStats.objects.all().delete()
+        call_command('rebuild_counters', queue=True, batch_size=1,
+                     stdout=StringIO())
+        self.assertEqual(jobs.run_pending(), 2)
+        post.refresh_from_db()
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(UserStats.objects.get(user=user).posts_count, 1)
+
+
+class JobWorkerTest(TransactionTestCase):
+
+    def test_run_worker(self):
+        """
+        run_worker выполняет задачи в пуле потоков и выходит с --once.
+        """
+        JOB_CALLS.clear()
+        for i in range(5):
+            jobs.enqueue(record_job, i)
+        out = StringIO()
+        # Один поток: тестовая база SQLite в памяти блокирует таблицы
+        # целиком, и выборка задач мешала бы их выполнению.
+        call_command('run_worker', workers=1, once=True, stdout=out)
+        self.assertEqual(sorted(JOB_CALLS), [(i,) for i in range(5)])
+        self.assertFalse(Job.objects.exists())
+        self.assertIn('5', out.getvalue())
+
+    def test_job_runs_outside_transaction(self):
+        """
+        Задача выполняется вне транзакции и не держит блокировку
+        записи SQLite, пока работает.
+        """
+        JOB_CALLS.clear()
+        jobs.enqueue(atomic_job)
+        self.assertEqual(jobs.run_pending(), 1)
+        self.assertEqual(JOB_CALLS, [(False,)])
+        self.assertFalse(Job.objects.exists())
+
+
+class DigestTest(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.end = notifications.window_end()
+        self.author = User.objects.create_user(username='author')
+        self.other = User.objects.create_user(username='other')
+        self.reader = User.objects.create_user(
+            username='reader', email='reader@example.com')
+        self.reader2 = User.objects.create_user(
+            username='reader2', email='reader2@example.com')
+        no_email = User.objects.create_user(username='no_email')
+        for user, author in ((self.reader, self.author),
+                             (self.reader, self.other),
+                             (self.reader2, self.author),
+                             (no_email, self.author)):
+            Follow.objects.create(user=user, author=author)
+        old = Post.objects.create(text='Старая запись', author=self.author)
+        Post.objects.filter(pk=old.pk).update(
+            pub_date=self.end - timedelta(days=1))
+        for author in (self.author, self.author, self.other):
+            Post.objects.create(text=f'Запись {author}', author=author)
+        Post.objects.exclude(pk=old.pk).update(
+            pub_date=self.end - timedelta(minutes=1))
+
+    def send(self, **kwargs):
+        return list(notifications.send_digests(now=self.end, rate=0,
+                                               **kwargs))
+
+    def test_one_digest_per_recipient(self):
+        """
+        Каждый подписчик с почтой получает одно письмо со всеми новыми
+        записями своих авторов за окно; повторный запуск ничего не шлёт.
+        """
+        self.send()
+        letters = {message.to[0]: message.body for message in mail.outbox}
+        self.assertEqual(set(letters),
+                         {'reader@example.com', 'reader2@example.com'})
+        self.assertEqual(letters['reader@example.com'].count('/author/'), 2)
+        self.assertEqual(letters['reader@example.com'].count('/other/'), 1)
+        self.assertEqual(letters['reader2@example.com'].count('/other/'), 0)
+        self.assertNotIn('Старая запись', letters['reader@example.com'])
+        self.assertEqual(self.send(), [])
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_batches_and_resume(self):
+        """
+        Пачки по одному получателю; прерванная рассылка продолжается
+        с последнего обработанного получателя.
+        """
+        DigestRun.objects.create(
+            window_start=self.end - timedelta(
+                seconds=settings.POSTS_DIGEST_WINDOW),
+            window_end=self.end,
+            last_user_id=self.reader.pk,
+        )
+        batches = self.send(batch_size=1)
+        self.assertEqual([message.to for message in mail.outbox],
+                         [['reader2@example.com']])
+        self.assertEqual(len(batches), 1)
+        run = DigestRun.objects.get()
+        self.assertEqual(run.sent, 1)
+        self.assertIsNotNone(run.finished)
+
+    @override_settings(POSTS_DIGEST_MAX_POSTS=1)
+    def test_long_digest_truncated(self):
+        """
+        В письме не больше POSTS_DIGEST_MAX_POSTS записей и ссылка
+        на ленту с остальными.
+        """
+        self.send()
+        body = [message.body for message in mail.outbox
+                if message.to == ['reader@example.com']][0]
+        self.assertIn('И ещё записей: 2', body)
+        self.assertIn(reverse('follow_index'), body)
+
+    def test_window_in_other_timezone(self):
+        """
+        Окно с датами не в UTC сравнивается с датами записей
+        как моменты времени, а не как строки.
+        """
+        late = Post.objects.create(text='Поздняя запись', author=self.author)
+        Post.objects.filter(pk=late.pk).update(
+            pub_date=self.end + timedelta(hours=1))
+        moscow = dt_timezone(timedelta(hours=3))
+        run = DigestRun(window_start=(self.end - timedelta(hours=1))
+                        .astimezone(moscow),
+                        window_end=self.end.astimezone(moscow))
+        posts, total = notifications.new_posts(run, [self.reader.pk],
+                                               10)[self.reader.pk]
+        self.assertEqual(total, 3)
+        self.assertNotIn(late, posts)
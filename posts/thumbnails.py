@@ -0,0 +1,61 @@
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as sorl_defaults
+from sorl.thumbnail.conf import settings as sorl_settings
+from sorl.thumbnail.images import ImageFile
+
+from . import cache, jobs
+from .models import Post
+
+# Размеры картинок записей, которые выводят шаблоны: имя -> (геометрия, опции)
+SIZES = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+}
+
+
+def lookup(file_, size):
+    """
+    Готовая миниатюра картинки или None, если её ещё не создали.
+    Опции дополняются так же, как в `ThumbnailBackend.get_thumbnail`,
+    чтобы имя миниатюры совпало с созданной в фоне.
+    """
+    geometry, options = SIZES[size]
+    options = dict(options)
+    backend = default.backend
+    source = ImageFile(file_)
+    if sorl_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(sorl_settings, attr)
+        if value != getattr(sorl_defaults, attr):
+            options.setdefault(key, value)
+    name = backend._get_thumbnail_filename(source, geometry, options)
+    return default.kvstore.get(ImageFile(name, default.storage))
+
+
+def generate(post_id):
+    """
+    Создаёт все миниатюры картинки записи и сбрасывает её карточку.
+    """
+    post = Post.objects.select_related(
+        'author', 'group').filter(pk=post_id).first()
+    if post is None or not post.image:
+        return
+    make(post.image)
+    cache.bump(f'post:{post.pk}', *cache.page_scopes(post))
+
+
+def make(image):
+    """
+    Создаёт все миниатюры картинки из SIZES.
+    """
+    for geometry, options in SIZES.values():
+        get_thumbnail(image, geometry, **options)
+
+
+def queue(post_id):
+    """
+    Ставит создание миниатюр записи в очередь фоновых задач.
+    """
+    jobs.enqueue(generate, post_id, dedup_key=f'thumbnails:{post_id}')
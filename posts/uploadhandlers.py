@@ -0,0 +1,54 @@
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class RejectedUpload(UploadedFile):
+    """
+    Пустая замена файла, который не прошёл по размеру.
+    """
+
+    def __init__(self, name, content_type, charset, content_type_extra):
+        super().__init__(BytesIO(), name, content_type, 0, charset,
+                         content_type_extra)
+
+
+class LimitedUploadHandler(FileUploadHandler):
+    """
+    Пропускает к следующим обработчикам только первые
+    POSTS_UPLOAD_MAX_SIZE байт файла. Остальное не сохраняется ни в память,
+    ни на диск, а вместо файла в `request.FILES` попадает `RejectedUpload`.
+
+    Должен стоять первым в FILE_UPLOAD_HANDLERS.
+    """
+
+    def handle_raw_input(self, input_data, META, content_length, boundary,
+                         encoding=None):
+        # Если тело больше лимита на файл и на обычные поля вместе,
+        # файлы не принимаются вовсе.
+        self.body_too_large = content_length > (
+            settings.POSTS_UPLOAD_MAX_SIZE
+            + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        )
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.too_large = self.body_too_large
+
+    def receive_data_chunk(self, raw_data, start):
+        if self.too_large:
+            return None
+        self.received += len(raw_data)
+        if self.received > settings.POSTS_UPLOAD_MAX_SIZE:
+            self.too_large = True
+            return None
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.too_large:
+            return RejectedUpload(self.file_name, self.content_type,
+                                  self.charset, self.content_type_extra)
+        return None
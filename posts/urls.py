@@ -1,6 +1,6 @@
 from django.urls import path
 
-from . import views
+from . import api, views
 from .views import PostCreate
 
 urlpatterns = [
@@ -13,12 +13,36 @@ urlpatterns = [
     # path("new/",
     #      PostCreate.as_view(),
     #      name="post_new"),
+    path("group/",
+         views.group_list,
+         name="group_list"),
     path("group/<slug:slug>/",
          views.group_posts,
          name="group"),
     path("follow/",
          views.follow_index,
          name="follow_index"),
+    path("follow/bulk/",
+         views.follow_bulk,
+         name="follow_bulk"),
+    path("search/",
+         views.post_search,
+         name="search"),
+    path("api/v1/posts/",
+         api.index,
+         name="api_index"),
+    path("api/v1/posts/<int:post_id>/",
+         api.post_detail,
+         name="api_post"),
+    path("api/v1/group/<slug:slug>/posts/",
+         api.group_posts,
+         name="api_group"),
+    path("api/v1/users/<str:username>/posts/",
+         api.profile,
+         name="api_profile"),
+    path("api/v1/follow/",
+         api.follow_index,
+         name="api_follow_index"),
     path("<str:username>/",
          views.profile,
          name='profile'),
@@ -28,6 +52,9 @@ urlpatterns = [
     path("<str:username>/<int:post_id>/edit/",
          views.post_edit,
          name='post_edit'),
+    path("<str:username>/<int:post_id>/comments/",
+         views.post_comments,
+         name="post_comments"),
     path("<username>/<int:post_id>/comment",
          views.add_comment,
          name="add_comment"),
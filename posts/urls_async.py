@@ -0,0 +1,16 @@
+from django.urls import path
+
+from . import views
+from .urls import urlpatterns as sync_urlpatterns
+
+# Вью, у которых для ASGI есть асинхронные версии
+ASYNC_VIEWS = {
+    'profile': views.profile_async,
+    'post_detail': views.post_view_async,
+}
+
+urlpatterns = [
+    path(str(pattern.pattern), ASYNC_VIEWS[pattern.name], name=pattern.name)
+    if pattern.name in ASYNC_VIEWS else pattern
+    for pattern in sync_urlpatterns
+]
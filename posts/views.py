@@ -1,14 +1,25 @@
+import asyncio
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.paginator import InvalidPage
-from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import Http404, HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
-from django.views.decorators.cache import cache_page
+from django.utils.http import urlencode
+from django.views.decorators.http import require_POST
 from django.views.generic import CreateView
 
+from . import feed, follows, search
+from .cache import cache_page_versioned, conditional_page, sync_page
+from .counters import feed_count
+from .db import replica_reads, run_query
 from .forms import PostForm, CommentForm
 from .models import Post, Group, Comment, Follow
+from .pagination import (PER_PAGE, cursor_page, encode_cursor, get_page,
+                         paginate, paginate_async)
 
 User = get_user_model()
 
@@ -26,12 +37,12 @@ class PostCreate(LoginRequiredMixin, CreateView):
                         self.object.pk)
 
 
-@cache_page(20)
+@replica_reads
+@cache_page_versioned(lambda: ['index'])
 def index(request):
-    post_list = Post.objects.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = pagination(paginator, page_number)
+    post_list = Post.objects.for_feed()
+    paginator, page = paginate(request, post_list, count=feed_count(
+        'index', Post.objects.count))
     return render(
         request,
         "posts/index.html",
@@ -42,12 +53,14 @@ def index(request):
     )
 
 
+@replica_reads
+@conditional_page(lambda slug: [f'group_page:{slug}'])
+@cache_page_versioned(lambda slug: [f'group_page:{slug}'])
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    post_list = group.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = pagination(paginator, page_number)
+    post_list = group.posts.for_feed()
+    paginator, page = paginate(request, post_list, count=feed_count(
+        f'group:{group.pk}', group.posts.count))
     return render(
         request,
         "posts/group.html",
@@ -59,12 +72,50 @@ def group_posts(request, slug):
     )
 
 
+@replica_reads
+@conditional_page(lambda: ['group_list'])
+@cache_page_versioned(lambda: ['group_list'])
+def group_list(request):
+    groups = Group.objects.with_stats().order_by('title')
+    return render(
+        request,
+        "posts/group_list.html",
+        {
+            "groups": groups,
+        }
+    )
+
+
+@replica_reads
+def post_search(request):
+    query = request.GET.get('q', '').strip()
+    if search.is_available():
+        results = search.SearchResults(query)
+    else:
+        results = Post.objects.for_feed().filter(text__icontains=query)
+    paginator = Paginator(results, PER_PAGE)
+    page = get_page(paginator, request.GET.get('page'))
+    return render(
+        request,
+        "posts/search.html",
+        {
+            "query": query,
+            "page": page,
+            "paginator": paginator,
+            "page_query": urlencode({'q': query}) + '&',
+        }
+    )
+
+
+@replica_reads
+@conditional_page(lambda username: [f'profile:{username}'])
+@cache_page_versioned(lambda username: [f'profile:{username}'])
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    post_list = author.posts.all()
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = pagination(paginator, page_number)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    post_list = author.posts.for_feed()
+    count = author.stats.posts_count if hasattr(author, 'stats') else None
+    paginator, page = paginate(request, post_list, count=count)
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user, author=author).exists()
     return render(
@@ -79,15 +130,21 @@ def profile(request, username):
     )
 
 
+@replica_reads
+@conditional_page(lambda username, post_id: [f'post:{post_id}',
+                                             f'profile:{username}'])
 def post_view(request, username, post_id):
-    author = get_object_or_404(User, username=username)
-    post = get_object_or_404(Post, pk=post_id, author=author)
+    author = get_object_or_404(User.objects.select_related('stats'),
+                               username=username)
+    post = get_object_or_404(Post.objects.for_feed(), pk=post_id,
+                             author=author)
     form = CommentForm()
-    comments = Comment.objects.filter(post=post)
+    comments, next_cursor = first_comments(post)
     return render(
         request,
         "posts/post_detail.html",
         {
+            'next_cursor': next_cursor,
             'post': post,
             'author': author,
             'comments': comments,
@@ -96,6 +153,120 @@ def post_view(request, username, post_id):
     )
 
 
+@replica_reads
+@sync_page(
+    conditional_page(lambda username: [f'profile:{username}']),
+    cache_page_versioned(lambda username: [f'profile:{username}']),
+)
+@transaction.non_atomic_requests
+async def profile_async(request, username):
+    """
+    Асинхронный `profile` для ASGI: сначала автор со счётчиками, затем
+    параллельно страница записей и подписка. Число записей берётся
+    из счётчика автора, как в `profile`, без COUNT(*).
+    """
+    author = await run_query(User.objects.select_related('stats').filter(
+        username=username).first)
+    if author is None:
+        raise Http404
+    count = author.stats.posts_count if hasattr(author, 'stats') else None
+
+    def is_following():
+        return request.user.is_authenticated and Follow.objects.filter(
+            user=request.user, author=author).exists()
+
+    (paginator, page), following = await asyncio.gather(
+        paginate_async(request, Post.objects.for_feed().filter(
+            author=author), count=count),
+        run_query(is_following),
+    )
+    return await run_query(
+        render,
+        request,
+        "posts/profile.html",
+        {
+            "page": page,
+            'paginator': paginator,
+            "author": author,
+            'following': following,
+        }
+    )
+
+
+@replica_reads
+@sync_page(
+    conditional_page(lambda username, post_id: [f'post:{post_id}',
+                                                f'profile:{username}']),
+)
+@transaction.non_atomic_requests
+async def post_view_async(request, username, post_id):
+    """
+    Асинхронный `post_view` для ASGI: автор, запись и первая пачка
+    комментариев читаются параллельно. Есть ли ещё комментарии, видно
+    по лишнему комментарию в пачке, а не по счётчику записи.
+    """
+    per_page = settings.POSTS_COMMENTS_PER_PAGE
+    comments = Comment.objects.filter(post_id=post_id).select_related(
+        'author').order_by('-created', '-pk')[:per_page + 1]
+    author, post, comments = await asyncio.gather(
+        run_query(User.objects.select_related('stats').filter(
+            username=username).first),
+        run_query(Post.objects.for_feed().filter(
+            pk=post_id, author__username=username).first),
+        run_query(list, comments),
+    )
+    if author is None or post is None:
+        raise Http404
+    next_cursor = None
+    if len(comments) > per_page:
+        comments = comments[:per_page]
+        next_cursor = encode_cursor(comments[-1].created, comments[-1].pk)
+    return await run_query(
+        render,
+        request,
+        "posts/post_detail.html",
+        {
+            'next_cursor': next_cursor,
+            'post': post,
+            'author': author,
+            'comments': comments,
+            'form': CommentForm(),
+        }
+    )
+
+
+@replica_reads
+def post_comments(request, username, post_id):
+    post = get_object_or_404(Post.objects.select_related('author'),
+                             pk=post_id, author__username=username)
+    comments = cursor_page(request, post.comments.select_related('author'),
+                           settings.POSTS_COMMENTS_PER_PAGE, 'created')
+    return render(
+        request,
+        "posts/includes/comment_list.html",
+        {
+            'post': post,
+            'comments': comments,
+            'next_cursor': comments.next_cursor,
+        }
+    )
+
+
+def first_comments(post):
+    """
+    Первая пачка комментариев записи и курсор следующей. Остались ли
+    ещё комментарии, видно по счётчику записи, без лишнего запроса.
+    """
+    per_page = settings.POSTS_COMMENTS_PER_PAGE
+    comments = post.comments.select_related('author').order_by(
+        '-created', '-pk')[:per_page]
+    next_cursor = None
+    if post.comments_count > per_page and comments:
+        last = comments[len(comments) - 1]
+        next_cursor = encode_cursor(last.created, last.pk)
+    return comments, next_cursor
+
+
 def post_edit(request, username, post_id):
     author = get_object_or_404(User, username=username)
     if request.user != author:
@@ -116,18 +287,6 @@ def post_edit(request, username, post_id):
     return redirect('post_detail', username=username, post_id=post_id)
 
 
-def pagination(paginator, page_number):
-    try:
-        page = paginator.page(page_number)
-    except PageNotAnInteger:
-        page = paginator.page(1)
-    except EmptyPage:
-        page = paginator.page(paginator.num_pages)
-    except InvalidPage:
-        page = paginator.page(1)
-    return page
-
-
 @login_required
 def create_post(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
@@ -178,11 +337,13 @@ def add_comment(request, username, post_id):
 
 
 @login_required
+@replica_reads
 def follow_index(request):
-    post_list = Post.objects.filter(author__following__user=request.user)
-    paginator = Paginator(post_list, 10)
-    page_number = request.GET.get('page')
-    page = pagination(paginator, page_number)
+    popular = feed.followed_popular(request.user)
+    post_list = feed.follow_feed(request.user, popular).for_feed()
+    paginator, page = paginate(request, post_list,
+                               field='feed_pub_date', key='feed_post',
+                               count=feed.follow_count(request.user, popular))
     return render(
         request,
         "posts/follow.html",
@@ -195,26 +356,43 @@ def follow_index(request):
 
 @login_required
 def profile_follow(request, username):
-    followed_author = get_object_or_404(User, username=username)
-    is_follow = Follow.objects.filter(author=followed_author,
-                                      user=request.user)
-    if request.user.username != username and not is_follow.exists():
-        follow = Follow.objects.create(
-            user=request.user,
-            author=followed_author
-        )
-        follow.save()
+    author = get_object_or_404(User, username=username)
+    follows.follow(request.user, author)
     return redirect('profile', username=username)
 
 
 @login_required
 def profile_unfollow(request, username):
-    follow_object = get_object_or_404(Follow, author__username=username,
-                                      user=request.user)
-    follow_object.delete()
+    author = get_object_or_404(User, username=username)
+    follows.unfollow(request.user, author)
     return redirect('profile', username=username)
 
 
+@login_required
+@require_POST
+def follow_bulk(request):
+    """
+    Подписка или отписка сразу от списка авторов: `username`
+    повторяется в теле запроса, `action` — `follow` или `unfollow`.
+    Имён не больше POSTS_FOLLOW_BULK_MAX.
+    """
+    action = request.POST.get('action', 'follow')
+    if action not in ('follow', 'unfollow'):
+        return HttpResponseBadRequest('action must be follow or unfollow')
+    usernames = request.POST.getlist('username')
+    if len(usernames) > settings.POSTS_FOLLOW_BULK_MAX:
+        return HttpResponseBadRequest(
+            f'at most {settings.POSTS_FOLLOW_BULK_MAX} usernames')
+    changed, missing = follows.change_many(
+        request.user,
+        usernames,
+        subscribe=action == 'follow',
+    )
+    return JsonResponse({'action': action,
+                         'changed': changed,
+                         'missing': missing})
+
+
 @login_required
 def comment_edit(request, username, post_id, comment_id):
     post_author = get_object_or_404(User, username=username)
@@ -222,7 +400,7 @@ def comment_edit(request, username, post_id, comment_id):
     comment = get_object_or_404(Comment, pk=comment_id, post=post)
     if request.user != comment.author:
         return redirect('post_detail', username=username, post_id=post_id)
-    comments = post.comments.all()
+    comments, next_cursor = first_comments(post)
     form = CommentForm(request.POST or None,
                        instance=comment)
     if not form.is_valid():
@@ -233,6 +411,7 @@ def comment_edit(request, username, post_id, comment_id):
                 'post': post,
                 'author': post_author,
                 'comments': comments,
+                'next_cursor': next_cursor,
                 'form': form,
                 'comment': comment
             }
@@ -0,0 +1,28 @@
+"""
+ASGI config for yatube project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Served this way, the profile and post pages use the async views from
+``posts.urls_async``.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
+"""
+
+import os
+
+from asgiref.sync import ThreadSensitiveContext
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'yatube.settings')
+os.environ.setdefault('YATUBE_ASYNC_VIEWS', '1')
+
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    # Django 3.1 runs every thread-sensitive call of every request on one
+    # shared thread, so sync middleware would serialize all requests.
+    # A context per request gives each one its own thread, as in 3.2.
+    async with ThreadSensitiveContext():
+        await django_application(scope, receive, send)
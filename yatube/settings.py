@@ -34,6 +34,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'posts.middleware.ProfilerMiddleware',
+    'posts.middleware.QueryBudgetMiddleware',
+    'posts.db.ReplicaStickinessMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -44,7 +47,12 @@ MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
-ROOT_URLCONF = 'yatube.urls'
+# Под ASGI (yatube/asgi.py) ленты автора и записи обслуживают
+# асинхронные вью
+if os.environ.get('YATUBE_ASYNC_VIEWS') == '1':
+    ROOT_URLCONF = 'yatube.urls_async'
+else:
+    ROOT_URLCONF = 'yatube.urls'
 
 TEMPLATES_DIR = os.path.join(BASE_DIR, "templates")
 TEMPLATES = [
@@ -65,6 +73,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'yatube.wsgi.application'
+ASGI_APPLICATION = 'yatube.asgi.application'
 
 # Database
 
@@ -72,14 +81,60 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Запись и обновление счётчиков в сигналах идут одной транзакцией
+        'ATOMIC_REQUESTS': True,
     }
 }
 
+# Реплика для чтения лент и записей, по умолчанию выключена. Включается
+# путём к файлу в YATUBE_REPLICA_PATH; копию основной базы в неё пишет
+# `replicate_db --interval`.
+POSTS_REPLICA_PATH = os.environ.get('YATUBE_REPLICA_PATH')
+POSTS_REPLICA_READS = bool(POSTS_REPLICA_PATH)
+if POSTS_REPLICA_PATH:
+    DATABASES['replica'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': POSTS_REPLICA_PATH,
+    }
+DATABASE_ROUTERS = ['posts.db.ReplicaRouter']
+# Сколько секунд после своей записи пользователь читает из основной базы
+POSTS_REPLICA_STICKY_SECONDS = 10
+
+# PRAGMA для каждого нового соединения с SQLite: WAL не блокирует читателей
+# пишущей транзакцией, busy_timeout (мс) ждёт блокировку вместо ошибки
+# «database is locked», NORMAL в режиме WAL не теряет целостность.
+# cache_size отрицательный — это размер в КБ.
+POSTS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'busy_timeout': 5000,
+    'synchronous': 'NORMAL',
+    'mmap_size': 128 * 1024 * 1024,
+    'cache_size': -16 * 1024,
+}
+
+# Кэш общий для всех процессов: версии областей сдвигают и процессы
+# сайта, и `run_worker` (миниатюры), и `replicate_db`. Кэш в памяти
+# процесса этих сдвигов бы не увидел.
+# Переполненный файловый кэш удаляет случайную треть записей, в том
+# числе версии областей и числа записей лент, и страницы снова
+# собираются с нуля. Предел поэтому с запасом на все страницы сайта;
+# если его не хватает, нужен общий сервер кэша (Redis, Memcached).
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'posts.cache_backends.SharedFileCache',
+        'LOCATION': os.environ.get('YATUBE_CACHE_DIR',
+                                   os.path.join(BASE_DIR, 'cache')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('YATUBE_CACHE_MAX_ENTRIES',
+                                              100000)),
+        },
     }
 }
+# Страницы лент сбрасываются сигналами, TTL лишь ограничивает память
+POSTS_PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+# Числа записей лент для пагинации сдвигаются сигналами, а раз в столько
+# секунд пересчитываются заново
+POSTS_FEED_COUNT_TIMEOUT = 60 * 60
 # Login
 
 LOGIN_URL = "/auth/login/"
@@ -122,7 +177,85 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загрузка файлов: файл больше лимита отбрасывается по мере чтения,
+# всё, что больше FILE_UPLOAD_MAX_MEMORY_SIZE, пишется кусками на диск
+FILE_UPLOAD_HANDLERS = [
+    'posts.uploadhandlers.LimitedUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+FILE_UPLOAD_MAX_MEMORY_SIZE = 512 * 1024
+POSTS_UPLOAD_MAX_SIZE = 5 * 1024 * 1024
+POSTS_IMAGE_MAX_PIXELS = 40 * 1000 * 1000
+
+# Фоновые задачи (posts.jobs), их выполняет `run_worker`. Попыток
+# на задачу; пауза перед повтором в секундах, удваивается с каждой
+# неудачей до максимума; сколько секунд взятая задача скрыта от других
+# исполнителей — не отчитавшийся за это время считается упавшим.
+POSTS_JOBS_MAX_ATTEMPTS = 5
+POSTS_JOBS_BACKOFF = 10
+POSTS_JOBS_BACKOFF_MAX = 60 * 60
+POSTS_JOBS_VISIBILITY_TIMEOUT = 5 * 60
+
+# Бюджеты SQL-запросов вью по имени адреса: число запросов, точных
+# повторов и, при желании, суммарное время (time_ms). В тестах превышение
+# роняет запрос (POSTS_QUERY_BUDGET_STRICT, включён в settings_test),
+# в работе пишется предупреждение в лог. Бюджеты подобраны по запросам
+# вошедшего пользователя (сессия, подписки) с запасом в пару запросов.
+POSTS_QUERY_BUDGETS = {
+    'index': {'queries': 6, 'duplicates': 0},
+    'group': {'queries': 8, 'duplicates': 0},
+    'group_list': {'queries': 6, 'duplicates': 0},
+    'profile': {'queries': 8, 'duplicates': 0},
+    'follow_index': {'queries': 10, 'duplicates': 0},
+    'post_detail': {'queries': 7, 'duplicates': 0},
+    'post_comments': {'queries': 7, 'duplicates': 0},
+    'search': {'queries': 8, 'duplicates': 0},
+    'api_index': {'queries': 3, 'duplicates': 0},
+    'api_post': {'queries': 4, 'duplicates': 0},
+    'api_group': {'queries': 4, 'duplicates': 0},
+    'api_profile': {'queries': 4, 'duplicates': 0},
+    'api_follow_index': {'queries': 6, 'duplicates': 0},
+}
+POSTS_QUERY_BUDGET_STRICT = False
+
+# Профилирование запросов: доля случайных запросов (0 — выключено)
+# и заголовок с токеном из `profile_report --token`, включающий его
+# для одного запроса. Хранятся последние POSTS_PROFILE_KEEP профилей.
+POSTS_PROFILE_SAMPLE_RATE = 0
+POSTS_PROFILE_HEADER = 'X-Profile'
+POSTS_PROFILE_TOKEN_MAX_AGE = 60 * 60 * 24
+POSTS_PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+POSTS_PROFILE_KEEP = 500
+
 # Email
 
 EMAIL_BACKEND = "django.core.mail.backends.filebased.EmailBackend"
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, "sent_emails")
+
+# Дайджест новых записей для подписчиков (send_digests): окно в секундах —
+# получатель получает не больше одного письма за окно; получателей в пачке;
+# писем в секунду (0 — без ограничения); записей в одном письме
+POSTS_DIGEST_WINDOW = 60 * 60
+POSTS_DIGEST_BATCH_SIZE = 100
+POSTS_DIGEST_RATE = 20
+POSTS_DIGEST_MAX_POSTS = 10
+
+# Лента подписок
+
+# Сколько записей хранится в ленте одного пользователя
+FEED_MAX_SIZE = 1000
+# Ленты подрезаются до FEED_MAX_SIZE на каждой N-й новой записи
+FEED_TRIM_EVERY = 20
+# Записи авторов с большим числом подписчиков не раскладываются по лентам,
+# а читаются напрямую
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+# До стольких подписчиков запись раскладывается по лентам в запросе,
+# больше — фоновой задачей
+FEED_FANOUT_INLINE_MAX = 200
+FEED_FANOUT_BATCH_SIZE = 1000
+# Сколько авторов можно подписать или отписать одним запросом follow_bulk
+POSTS_FOLLOW_BULK_MAX = 100
+
+# Сколько комментариев выводить на странице записи и догружать за раз
+POSTS_COMMENTS_PER_PAGE = 20
@@ -0,0 +1,25 @@
+"""
+Настройки для тестов: `manage.py test` и pytest.
+
+Превышение бюджета SQL-запросов роняет запрос, а реплика — зеркало
+основной базы, чтобы тесты проверяли маршрутизацию чтений. Кэш
+во временном каталоге: `cache.clear()` в тестах не трогает кэш сайта.
+"""
+import atexit
+import os
+import shutil
+import tempfile
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR, CACHES, DATABASES
+
+POSTS_QUERY_BUDGET_STRICT = True
+
+DATABASES['replica'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+    'TEST': {'MIRROR': 'default'},
+}
+
+CACHES['default']['LOCATION'] = tempfile.mkdtemp(prefix='yatube-cache-')
+atexit.register(shutil.rmtree, CACHES['default']['LOCATION'], True)
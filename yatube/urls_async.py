@@ -0,0 +1,16 @@
+"""
+Адреса для ASGI: те же, что в yatube.urls, но ленты и записи
+обслуживают асинхронные вью из posts.urls_async.
+"""
+from django.urls import include, path
+
+from . import urls
+
+handler404 = urls.handler404
+handler500 = urls.handler500
+
+urlpatterns = [
+    path('', include('posts.urls_async'))
+    if getattr(pattern, 'urlconf_name', None) == 'posts.urls' else pattern
+    for pattern in urls.urlpatterns
+]